@@ -1,20 +1,28 @@
 """A module for managing application configuration in a thread-safe manner."""
+from collections.abc import Mapping
+from dataclasses import dataclass
 import threading
+import json
 import os
+import sys
 import logging
-from typing import Any, List, Union
-from functools import reduce
+from typing import Any, List, Optional, Union
+from types import MappingProxyType
+from functools import lru_cache, partial, reduce
 import operator
 
 import yaml
 
+# Prefer the libyaml backed loader when PyYAML was built with it.  Same safety guarantees as SafeLoader, but the
+# scanning and parsing happens in C.
+try:
+    from yaml import CSafeLoader as _SafeLoader
+except ImportError:
+    from yaml import SafeLoader as _SafeLoader
+
 logger = logging.getLogger(__name__)
 
-# The root directory of the app.  Commented out version is root if not in csue
-# app_root = os.path.realpath(os.path.join(os.path.basename(__file__), ".."))
-# app_root = os.path.realpath(os.path.join(os.path.dirname(__file__),
-#                                          "..", "..", "..", ".."))
-# Launcher scripts should set this.
+# The root directory of the app.  Launcher scripts should set this.
 app_root = os.environ.get('APP_ROOT')
 
 # CSUE variables - challenging to use these if not using CSUE templates.
@@ -23,62 +31,230 @@ CSUE_APP_PATH = app_root
 CSUE_LOG_DIR = f"{CSUE_APP_PATH}/fileio/log"
 CSUE_CONFIG_DIR = f"{CSUE_APP_PATH}/fileio/config"
 
-# The configuration dictionary for the application
-_CONFIG = {}
+# The configuration dictionary for the application.  This is a deeply read-only view (nested dicts are MappingProxyTypes
+# and lists are tuples) that is replaced wholesale by writers, never modified in place.  Readers take a local reference
+# and need no locking since rebinding a module attribute is atomic.
+_CONFIG = MappingProxyType({})
+
+# Flat index of _CONFIG mapping the tuple path of every nested dictionary key to its value, so that deep lookups are a
+# single hash probe.  The empty path maps to _CONFIG itself.  Published alongside _CONFIG.
+_FLAT = {(): _CONFIG}
 
-# Lock for accessing configuration
+# Lock serializing writers of the configuration
 _CONFIG_LOCK = threading.Lock()
 
+# Config parameters that must be present, and their required types once frozen.  Checked by validate_config.
+_REQUIRED = (
+    ('signals', tuple),
+    ('meta_pvs', tuple),
+    ('base_dir', str),
+    ('email', Mapping),
+    ('failure_threshold', float),
+    ('db_config', Mapping),
+    ('min_beam_current', float),
+)
+
+# Names of value types as they are written in YAML, for error messages.  The frozen config holds YAML lists as tuples
+# and mappings as MappingProxyTypes, which would confuse users.  Checked in order, so bool comes before the numbers.
+_YAML_TYPE_NAMES = (
+    (bool, "boolean"),
+    ((int, float), "number"),
+    (str, "string"),
+    ((tuple, list), "list"),
+    (Mapping, "mapping"),
+    (type(None), "null"),
+)
+
+
+def _yaml_type_name(typ: type) -> str:
+    """Return the YAML name for values of type typ, e.g., 'list' for a tuple."""
+    for types, name in _YAML_TYPE_NAMES:
+        if issubclass(typ, types):
+            return name
+    return typ.__name__
+
+
+# Sentinel for config parameters that are not present
+_MISSING = object()
+
+
+@dataclass(frozen=True, slots=True)
+class Config:
+    """Read-only snapshot of the required config parameters, available once the config has been validated.
+
+    Attribute access is cheaper than get_parameter for code that reads these on every acquisition.
+    """
+    signals: tuple
+    meta_pvs: tuple
+    base_dir: str
+    email: Mapping
+    failure_threshold: float
+    db_config: Mapping
+    min_beam_current: float
+
+
+# The most recently validated _CONFIG and the Config built from it
+_VALIDATED = (None, None)
+
+# Previously parsed config files.  Maps filename to ((st_mtime_ns, st_size), parsed contents) so that reloading an
+# unchanged file skips the I/O and YAML parsing.
+_PARSE_CACHE = {}
+
+# Lock for accessing the parse cache.  Separate from _CONFIG_LOCK so that parsing doesn't block config readers.
+_PARSE_CACHE_LOCK = threading.Lock()
+
+
+@lru_cache(maxsize=256)
+def _compile_path(path: tuple):
+    """Build an accessor for a path of keys into a nested dictionary.  Memoized as callers use a few constant paths."""
+    if len(path) == 1:
+        return operator.itemgetter(path[0])
+    if len(path) == 2:
+        first, second = path
+        return lambda d: d[first][second]
+    return partial(reduce, operator.getitem, path)
+
 
 def _get_from_dict(d: dict, key_list: list):
     """Query a value from a nested dictionary using a list of keys."""
-    return reduce(operator.getitem, key_list, d)
+    return _compile_path(tuple(key_list))(d)
+
 
+def _freeze(value: Any, path: tuple = (), flat: Optional[dict] = None) -> Any:
+    """Return a deeply read-only copy of value.  Mappings become MappingProxyTypes, lists become tuples and sets become
+    frozensets.
 
-def _set_in_dict(d: dict, key_list: list, value: Any):
-    """Set a values from a nested dictionary using a list of keys."""
-    _get_from_dict(d, key_list[:-1])[key_list[-1]] = value
+    String keys are interned so that lookups with string literals (which the compiler interns) match keys by identity
+    instead of comparing strings.  If flat is given, the path to every value under nested mappings, including
+    intermediate mappings, is recorded into it along the way.
+    """
+    if isinstance(value, Mapping):
+        frozen = {}
+        for k, v in value.items():
+            if isinstance(k, str):
+                k = sys.intern(k)
+            child_path = path + (k,)
+            child = _freeze(v, child_path, flat)
+            frozen[k] = child
+            if flat is not None:
+                flat[child_path] = child
+        return MappingProxyType(frozen)
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(value)
+    return value
+
+
+def _publish(config: Mapping):
+    """Publish a frozen copy of config as the application configuration.  Caller must hold _CONFIG_LOCK."""
+    # pylint: disable=global-statement
+    global _CONFIG, _FLAT
+    # Freeze and index in a single walk of the config
+    flat = {}
+    proxy = _freeze(config, (), flat)
+    flat[()] = proxy
+    _CONFIG = proxy
+    _FLAT = flat
+
+
+def _json_cache_path(filename: str) -> str:
+    """The path of the JSON cache kept for a config file."""
+    return f"{filename}.cache.json"
 
 
-def parse_config_file(filename: str = f"{app_root}/cfg.yaml"):
+def _read_json_cache(filename: str, file_key: tuple) -> Any:
+    """Read the JSON cache of a config file.  Returns _MISSING if there is no cache for this version of the file."""
+    try:
+        with open(_json_cache_path(filename), mode="rb") as f:
+            payload = json.load(f)
+    except (OSError, ValueError):
+        return _MISSING
+
+    if not isinstance(payload, dict) or (payload.get("mtime_ns"), payload.get("size")) != file_key:
+        return _MISSING
+    return payload.get("config", _MISSING)
+
+
+def _write_json_cache(filename: str, file_key: tuple, config: Any):
+    """Save the parsed config file as JSON alongside it.  Skipped if JSON can't faithfully represent the config, e.g.
+    non-string keys or dates, or the directory isn't writable."""
+    cache_path = _json_cache_path(filename)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        text = json.dumps({"mtime_ns": file_key[0], "size": file_key[1], "config": config})
+        if json.loads(text)["config"] != config:
+            logger.debug("Not caching %s.  Config does not round trip through JSON.", filename)
+            return
+        with open(tmp_path, mode="w", encoding="utf-8") as f:
+            f.write(text)
+        # Atomic, so concurrent readers see either the old cache or the new one.
+        os.replace(tmp_path, cache_path)
+    except (OSError, TypeError, ValueError) as exc:
+        logger.debug("Not caching %s: %s", filename, exc)
+
+
+def parse_config_file(filename: str = f"{app_root}/cfg.yaml", use_cache: bool = True):
     """Process an application level configuration file
 
+    Files that have not changed (same mtime and size) since they were last parsed are served from a cache.  With
+    use_cache, the parsed file is also saved as JSON next to the config file (<filename>.cache.json) and loaded from
+    there by later processes, which is much faster than parsing YAML.
+
     Args:
         filename:  The name of the file parse
+        use_cache:  Read and write the on disk JSON cache.  Pass False to parse the YAML if it is not in memory already.
     """
-    # pylint: disable=global-variable-not-assigned
-    global _CONFIG, _CONFIG_LOCK
-    with _CONFIG_LOCK:
-        try:
-            with open(filename, mode="r", encoding="utf-8") as f:
-                _CONFIG = yaml.safe_load(f)
+    try:
+        st = os.stat(filename)
+        file_key = (st.st_mtime_ns, st.st_size)
+        with _PARSE_CACHE_LOCK:
+            cached = _PARSE_CACHE.get(filename)
+
+        if cached is not None and cached[0] == file_key:
+            config = cached[1]
+        else:
+            config = _read_json_cache(filename, file_key) if use_cache else _MISSING
+            if config is _MISSING:
+                # Hand libyaml the raw bytes.  It detects the encoding and decodes in C, skipping Python's text layer.
+                with open(filename, mode="rb") as f:
+                    config = yaml.load(f, Loader=_SafeLoader)
+                if use_cache:
+                    _write_json_cache(filename, file_key, config)
+            with _PARSE_CACHE_LOCK:
+                _PARSE_CACHE[filename] = (file_key, config)
+
+    except yaml.YAMLError as exc:
+        # Print out the portion of config file near the error.
+        if hasattr(exc, 'problem_mark'):
+            line = exc.problem_mark.line + 1
+            column = exc.problem_mark.column
+            logger.error("Error parsing %s near line %s column %s", filename, line, column)
+        else:
+            logger.error("Error parsing config: %s", exc)
+        raise
 
-        except yaml.YAMLError as exc:
-            # Print out the portion of config file near the error.
-            if hasattr(exc, 'problem_mark'):
-                line = exc.problem_mark.line + 1
-                column = exc.problem_mark.column
-                logger.error("Error parsing %s near line %s column %s", filename, line, column)
-            else:
-                logger.error("Error parsing config: %s", exc)
-            raise
+    except Exception as exc:
+        logger.error("Error reading file %s': %s", filename, exc)
+        raise exc
 
-        except Exception as exc:
-            logger.error("Error reading file %s': %s", filename, exc)
-            raise exc
+    # Publishing freezes a new copy, so the cached copy is never handed out.
+    with _CONFIG_LOCK:
+        _publish(config)
 
 
 def clear_config():
     """Clear the configuration"""
-    # pylint: disable=global-variable-not-assigned
-    global _CONFIG, _CONFIG_LOCK
     with _CONFIG_LOCK:
-        _CONFIG = {}
+        _publish({})
 
 
 def set_parameter(key: Union[str, List[str]], value: Any):
     """Set an individual _CONFIG parameter.  Thread safe.
 
+    The update is copy-on-write.  A new, frozen _CONFIG is published with the change, so a configuration previously
+    handed to a reader never changes underneath it.
+
     Note: This class doesn't currently support saving config files to disk, but any value set here would need to be
     json serializable if that functionality is desired.
 
@@ -88,73 +264,143 @@ def set_parameter(key: Union[str, List[str]], value: Any):
             key = "db_config" would query _CONFIG["db_config"].
         value:  The value to set.  Can be any object.
     """
-    # pylint: disable=global-variable-not-assigned
-    global _CONFIG, _CONFIG_LOCK
     with _CONFIG_LOCK:
-        if isinstance(key, str):
-            _CONFIG[key] = value
-        elif len(key) == 1:
-            _CONFIG[key[0]] = value
-        else:
-            _get_parameter(key[:-1])[key[-1]] = value
+        path = (key,) if isinstance(key, str) else key
+        config = dict(_CONFIG)
+        parent = config
+        # Walk down by index rather than slicing off the last key, copying each level as we go
+        for i in range(len(path) - 1):
+            child = dict(parent[path[i]])
+            parent[path[i]] = child
+            parent = child
+        parent[path[-1]] = value
+        _publish(config)
 
 
 def get_parameter(key: Union[str, List[str], None]) -> Any:
-    """Set an individual _CONFIG parameter.  If key is None, return entire dictionary.  Thread safe.
+    """Set an individual _CONFIG parameter.  If key is None, return entire dictionary.  Thread safe and lock-free.
 
     Args:
         key:  A string for top level parameter.  A list of strings where each string is key on the path to the desired
             parameter.  Example key = ["db_config", "user"] would query _CONFIG["db_config"]["user"], while
             key = "db_config" would query _CONFIG["db_config"].
     """
-    # pylint: disable=global-variable-not-assigned
-    global _CONFIG_LOCK
-    with _CONFIG_LOCK:
-        return _get_parameter(key)
+    if key is None:
+        # The published config is immutable, so the whole thing can be handed out as is.
+        return _CONFIG
+    return _get_parameter(_FLAT, key)
+
+
+def get_parameters(keys: List[Union[str, List[str], None]]) -> List[Any]:
+    """Get several _CONFIG parameters at once.  Thread safe and lock-free.
+
+    All values come from the same configuration, even if it is replaced part way through.
+
+    Args:
+        keys:  A list of keys, each in any form accepted by get_parameter.
+
+    Returns:
+        The parameter values in the same order as keys.  Parameters that don't exist are None.
+    """
+    flat = _FLAT
+    return [_get_parameter(flat, key) for key in keys]
+
+
+# How to turn a key into a path for _get_parameter, by exact type of key.  See _key_path for any other type.
+_PATHS = {
+    str: lambda key: (key,),
+    list: tuple,
+    tuple: lambda key: key,
+    type(None): lambda key: (),
+}
+
+
+def _key_path(key: Union[str, List[str], None]) -> tuple:
+    """Turn a key in any form accepted by get_parameter into a tuple path.
+
+    The common key types are dispatched through _PATHS.  On a miss, a str subclass (e.g. a str enum or numpy.str_) is
+    a single key rather than being split into characters, and anything else is treated as a sequence of keys.
+    """
+    to_path = _PATHS.get(type(key))
+    if to_path is not None:
+        return to_path(key)
+    if isinstance(key, str):
+        return (key,)
+    return tuple(key)
+
+
+def _get_parameter(flat: dict, key: Union[str, List[str], None]) -> Any:
+    """Set an individual config parameter from the flat index of a config.  If key is None, return entire dictionary.
 
+    Callers take a single reference to _FLAT so that the whole lookup sees the same config even if a writer publishes a
+    new one.  Internal use.
+    """
+    path = _key_path(key)
+    try:
+        return flat[path]
+    except KeyError:
+        pass
 
-def _get_parameter(key: Union[str, List[str], None]) -> Any:
-    """Set an individual config parameter.  If key is None, return entire dictionary.  Not thread safe, internal use."""
-    # pylint: disable=global-variable-not-assigned
-    global _CONFIG, _CONFIG_LOCK
-    out = None
+    # Only paths through dictionaries are indexed.  Walk the config for anything else, e.g. list indices.
     try:
-        if key is None:
-            out = _CONFIG
-        elif isinstance(key, str):
-            out = _CONFIG[key]
-        else:
-            out = _get_from_dict(_CONFIG, key)
+        return _get_from_dict(flat[()], path)
     except KeyError:
         # It's OK to request a parameter that doesn't exist, you get None back
-        pass
+        return None
 
-    return out
 
+def _compile_validator(required: tuple):
+    """Compile a schema of (key, type) pairs into a function that checks a config and returns a Config built from it.
 
-def validate_config():
-    """Make sure that a handful of required _CONFIG settings are present and of correct type."""
-    # pylint: disable=global-variable-not-assigned
-    global _CONFIG, _CONFIG_LOCK
-    required = [
-        ('signals', list),
-        ('meta_pvs', list),
-        ('base_dir', str),
-        ('email', dict),
-        ('failure_threshold', float),
-        ('db_config', dict),
-        ('min_beam_current', float)
-    ]
+    Accepted types are worked out once here.  Float parameters also accept ints (YAML loads "0" as an int) and are
+    converted to float in the Config.
+    """
+    checks = tuple((key, typ, (int, float) if typ is float else typ, _yaml_type_name(typ)) for key, typ in required)
 
-    with _CONFIG_LOCK:
-        for entry in required:
-            (key, typ) = entry
-            if key not in _CONFIG.keys():
+    def validate(config: Mapping) -> Config:
+        values = {}
+        for key, typ, accepted, typ_name in checks:
+            value = config.get(key, _MISSING)
+            if value is _MISSING:
                 raise ValueError(f"Configuration is missing '{key}")
-            # Check that all of these are floats / numbers
-            if not isinstance(_CONFIG[key], typ):
+            # Check that all of these are of the right type.  No required parameter is a bool, but bools are ints.
+            if isinstance(value, bool) or not isinstance(value, accepted):
+                value_name = _yaml_type_name(type(value))
                 logger.error("Required config parameter '%s' is not required type '%s'."
-                             "  Received '%s' of type '%s'", key, typ, _CONFIG[key], type(_CONFIG[key]))
-                logger.error("_CONFIG = %s", _CONFIG)
-                raise ValueError(f"Required config parameter '{key}' is not required type '{typ}'."
-                                 f"  Received '{_CONFIG[key]}' of type '{type(_CONFIG[key])}'")
+                             "  Received '%s' of type '%s'", key, typ_name, value, value_name)
+                logger.error("_CONFIG = %s", config)
+                raise ValueError(f"Required config parameter '{key}' is not required type '{typ_name}'."
+                                 f"  Received '{value}' of type '{value_name}'")
+            values[key] = float(value) if typ is float else value
+        return Config(**values)
+
+    return validate
+
+
+_validate = _compile_validator(_REQUIRED)
+
+
+def validate_config() -> Config:
+    """Make sure that a handful of required _CONFIG settings are present and of correct type.
+
+    Returns:
+        A Config snapshot of the required settings.  Also available afterwards from get_config().
+    """
+    # pylint: disable=global-statement
+    global _VALIDATED
+    config = _CONFIG
+    config_obj = _validate(config)
+    _VALIDATED = (config, config_obj)
+    return config_obj
+
+
+def get_config() -> Config:
+    """Get the required config parameters as a Config.  Thread safe and lock-free.
+
+    The current config is validated first if it has changed since the last validate_config call.  Raises ValueError if
+    it is not valid.
+    """
+    validated, config_obj = _VALIDATED
+    if validated is _CONFIG:
+        return config_obj
+    return validate_config()
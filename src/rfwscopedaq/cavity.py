@@ -3,8 +3,7 @@ import time
 from contextlib import contextmanager
 import threading
 from datetime import datetime
-import math
-from typing import Any, Dict, Tuple
+from typing import Any, Dict, List, Tuple
 
 import epics
 import numpy as np
@@ -15,6 +14,9 @@ from . import app_config as cfg
 class Cavity:
     """A class for interacting with RF Cavities.  In particular all EPICS interactions should be handled here."""
 
+    # The (sample_interval, trigger_delay, periodic, wf_debug) scope settings used for data collection
+    daq_scope_settings = (0.2, 102.4, 0.1, 1)
+
     def _data_ready_cb(self, value=None, timestamp=None, **kwargs):
         """This callback should only be used to monitor the R...STAT2b.B3 PV to see when the FCC has updated data.
 
@@ -30,35 +32,67 @@ class Cavity:
             with self.data_ready_lock:
                 if value == 256 and self.first_time:
                     self.data_ready = False
+                    self._ready_event.clear()
                     self.window_start = timestamp
                 # We've read all the waveforms into EPICS records and are calculating statistics.
                 elif value == 512 and self.first_time:
                     self.window_end = timestamp
                     self.data_ready = True
+                    self._ready_event.set()
+
+    def _waveform_cb(self, pvname=None, value=None, timestamp=None, **kwargs):
+        """Monitor callback for the waveform PVs.  Caches the latest value and timestamp of each waveform."""
+        with self.data_ready_lock:
+            self.waveforms[pvname] = (value, timestamp)
+
+    def _state_cb(self, **kwargs):
+        """Monitor callback for the PVs that make up is_state_valid.  Keeps state_valid_event in sync with them."""
+        self.refresh_state_valid()
 
-    def _connection_cb(self, pvname=None, conn=None):
-        """Callback used to track connection status for cavity PVs in a single data structure."""
-        with self.pv_conn_lock:
-            self.pv_conns[pvname] = conn
+    def refresh_state_valid(self) -> bool:
+        """Check is_state_valid and set or clear state_valid_event to match.  Any error counts as an invalid state.
+
+        Monitors for different PVs call this from different CA threads.  The check and the update happen under one lock
+        so that an older result can't overwrite a newer one.
+        """
+        with self._state_lock:
+            # Broad exception since this runs in CA callbacks where nobody can handle an error, e.g., a PV has no value
+            # because it disconnected, or the config is invalid.  Neither is a valid state.
+            # pylint: disable=broad-exception-caught
+            try:
+                valid = self.is_state_valid()
+            except Exception:
+                valid = False
+            if valid:
+                self.state_valid_event.set()
+            else:
+                self.state_valid_event.clear()
+        return valid
 
     def pvs_connected(self):
         """Are all PVs currently connected."""
-        all_connected = False
-        with self.pv_conn_lock:
-            if len(self.pv_conns.keys()) > 0:
-                all_connected = all(self.pv_conns.values())
-        return all_connected
+        return len(self.pvs) > 0 and all(pv.connected for pv in self.pvs)
 
     def __init__(self, epics_name, waveform_signals):
         """Initialize a Cavity object and connect to it's PVs.  Exception raised if unable to connect."""
+        # pylint: disable=too-many-statements
         self.epics_name = epics_name
 
         # Track that we are not catching the scope state machine mid-cycle
         self.first_time = False
 
-        # Structure for tracking connection status.  It's probable that pyepics has something like this built-in.
-        self.pv_conns = {}
-        self.pv_conn_lock = threading.Lock()
+        # The data_ready flag will be updated from callbacks and work thread.  Indicates that the data set is ready to
+        # harvest.  Created before any PVs since their callbacks may run as soon as they connect.
+        self.data_ready_lock = threading.Lock()
+        self.data_ready = False
+        # Mirrors data_ready so get_waveforms can sleep until the callback reports new data instead of polling for it.
+        self._ready_event = threading.Event()
+
+        # Latest (value, timestamp) of each waveform PV keyed by PV name, as delivered by their monitors.  Access should
+        # be synchronized using data_ready_lock.
+        self.waveforms = {}
+
+        # All of the cavity's PVs.  pyepics tracks the connection status of each one.
         self.pvs = []
 
         # Is the cavity RF on
@@ -72,15 +106,21 @@ class Cavity:
         self.cntl2mode = epics.PV(f"{epics_name}CNTL2MODE")
         self.pvs.append(self.cntl2mode)
 
-        # Data PVs
+        # Data PVs.  The IOC pushes each new waveform to us so there is no need to fetch them once data is ready.  Use
+        # the time form so that monitor timestamps come from the IOC and are comparable to the acquisition window.  The
+        # native form would give us the local time the update was received.
         self.waveform_pvs = {}
         for signal in waveform_signals:
-            self.waveform_pvs[epics_name + signal] = epics.PV(epics_name + signal, auto_monitor=False)
+            self.waveform_pvs[epics_name + signal] = epics.PV(epics_name + signal, form='time',
+                                                              auto_monitor=epics.dbr.DBE_VALUE,
+                                                              callback=self._waveform_cb)
             self.pvs.append(self.waveform_pvs[epics_name + signal])
 
+        # The scope setting PVs below are explicitly monitored so that the checks in setup_scope and scope_mode read the
+        # locally cached values instead of making a CA round trip per PV.
         # Control the waveform mode.  Not sure why we have two separate PVs, but this is the API.
         # -1 = User requested stop, 0 = Is Stopped, 1 = single, 2 = run, 3 = periodic, others also exist.
-        self.scope_setting = epics.PV(f"{epics_name}WFSCOPrun")
+        self.scope_setting = epics.PV(f"{epics_name}WFSCOPrun", auto_monitor=True)
         self.pvs.append(self.scope_setting)
 
         # Notification flags for OPS
@@ -94,23 +134,19 @@ class Cavity:
 
         # Change Periodic Delay to 0.1 secs.  Typical default is 1, Don't go lower than 0.1.  This is a pause that
         # happens somewhere during the data collection cycle.
-        # self.periodic_setting = epics.PV(f"{epics_name}WFSCOPper", connection_callback=self._connection_cb)
-        self.periodic_setting = epics.PV(f"{epics_name}WFSCOPper")
+        self.periodic_setting = epics.PV(f"{epics_name}WFSCOPper", auto_monitor=True)
         self.pvs.append(self.periodic_setting)
 
         # Sample interval within a waveform
-        # self.sample_interval = epics.PV(f"{epics_name}TRGS1", connection_callback=self._connection_cb)
-        self.sample_interval = epics.PV(f"{epics_name}TRGS1")
+        self.sample_interval = epics.PV(f"{epics_name}TRGS1", auto_monitor=True)
         self.pvs.append(self.sample_interval)
 
         # Controls skipping waveform statistic calculations
-        # self.wf_debug = epics.PV(f"{epics_name}WFSdebug1", connection_callback=self._connection_cb)
-        self.wf_debug = epics.PV(f"{epics_name}WFSdebug1")
+        self.wf_debug = epics.PV(f"{epics_name}WFSdebug1", auto_monitor=True)
         self.pvs.append(self.wf_debug)
 
         # Waveform collection trigger delay - used in harvester, but not sure if it has impact here.
-        # self.trigger_delay = epics.PV(f"{epics_name}TRGD1", connection_callback=self._connection_cb)
-        self.trigger_delay = epics.PV(f"{epics_name}TRGD1")
+        self.trigger_delay = epics.PV(f"{epics_name}TRGD1", auto_monitor=True)
         self.pvs.append(self.trigger_delay)
 
         # New Firmware has new sequencer state PV - the states that matter are these values.
@@ -124,18 +160,11 @@ class Cavity:
         # self.scope_reached_read_step = False  # Is the sequencer currently at or past the read step (2048) this cycle.
 
         # New firmware includes string PVs that track the time the fpga was reading data
-        # self.fpga_start_PV = epics.PV(f"{epics_name}WFSharvTake", connection_callback=self._connection_cb)
         self.fpga_start_pv = epics.PV(f"{epics_name}WFSharvTake")
         self.pvs.append(self.fpga_start_pv)
-        # self.fpga_end_PV = epics.PV(f"{epics_name}WFSharvDa", connection_callback=self._connection_cb)
         self.fpga_end_pv = epics.PV(f"{epics_name}WFSharvDa")
         self.pvs.append(self.fpga_end_pv)
 
-        # The data_ready flag will be updated from callbacks and work thread.  Indicates that the data set is ready to
-        # harvest.
-        self.data_ready_lock = threading.Lock()
-        self.data_ready = False
-
         # Need to monitor beam current.  User may specify a minimum beam current for data collection.
         self.beam_current = epics.PV("R2XXITOT")
         self.pvs.append(self.beam_current)
@@ -149,31 +178,29 @@ class Cavity:
         self.window_start = None
         self.window_end = None
 
-        # Track connection status of the PVs
-        with self.pv_conn_lock:
-            for pv in self.pvs:
-                # Make sure we don't set to false if the connection CB has already run.
-                if pv.pvname not in self.pv_conns:
-                    self.pv_conns[pv.pvname] = False
-
         # Wait for things to connect.  If the IOC isn't available at the start, raise an exception for the worker thread
         # to handle.
         for pv in self.pvs:
             if not pv.wait_for_connection(timeout=2):
                 raise RuntimeError(f"Could not connect to PV '{pv.pvname}'")
 
+        # Set while the cavity is in a valid state for collecting data so callers can wait on it instead of polling
+        # is_state_valid.  Driven by monitors on the underlying PVs.
+        self.state_valid_event = threading.Event()
+        self._state_lock = threading.Lock()
+        for pv in (self.stat1, self.rf_on, self.cntl2mode, self.beam_current):
+            pv.add_callback(self._state_cb)
+        self._state_cb()
+
         # Track the initial state of the scope settings so that they can be returned to later
-        self.init_mode = self.__get_pv(self.scope_setting)
-        self.init_sample_interval = self.__get_pv(self.sample_interval)
-        self.init_trigger_delay = self.__get_pv(self.trigger_delay)
-        self.init_periodic_setting = self.__get_pv(self.periodic_setting)
-        self.init_debug_setting = self.__get_pv(self.wf_debug)
+        (self.init_mode, self.init_sample_interval, self.init_trigger_delay, self.init_periodic_setting,
+         self.init_debug_setting) = self.__get_scope_settings()
 
     def get_fpga_times(self):
         """Read the timestamps for when the FPGA started and stopped collecting data."""
-        fmt = "%Y-%m-%d %H:%M:%S.%f"
-        self.fpga_start = datetime.strptime(self.__get_pv(self.fpga_start_pv), fmt)
-        self.fpga_end = datetime.strptime(self.__get_pv(self.fpga_end_pv), fmt)
+        # The IOC formats these as "%Y-%m-%d %H:%M:%S.%f", which fromisoformat parses much faster than strptime.
+        self.fpga_start = datetime.fromisoformat(self.__get_pv(self.fpga_start_pv))
+        self.fpga_end = datetime.fromisoformat(self.__get_pv(self.fpga_end_pv))
 
     def is_gradient_ramping(self):
         """Check if the cavity is currently ramping gradient."""
@@ -201,7 +228,7 @@ class Cavity:
     def is_beam_current_sufficient(self):
         """Check that we have enough beam current present in the machine for data to be valid."""
         beam_current = self.__get_pv(self.beam_current)
-        return beam_current > cfg.get_parameter("min_beam_current")
+        return beam_current > cfg.get_config().min_beam_current
 
     def is_state_valid(self):
         """Check that the cavity is in a valid state for collecting data."""
@@ -214,7 +241,7 @@ class Cavity:
 
     def get_waveforms(self, timeout=60, sleep_dur=0.05) -> Tuple[Dict[str, np.ndarray], datetime, datetime]:
         """Waits for the FCC to have reported data is ready, then grabs those waveforms.  Checks for valid timestamps"""
-        count = 0
+        deadline = time.monotonic() + timeout
         while True:
             # Check that the sequencer-related PV is still connected since that is what drives this whole process.
             if not self.scope_seq_step.connected:
@@ -222,56 +249,70 @@ class Cavity:
                                    f"disconnected.")
 
             get_data = False
+            waveforms = {}
+            window_start = window_end = None
             # Wait for data to be ready, but timeout eventually.
-            # Don't hold this lock too long.  CA from this thread won't complete while a callback is in active
+            # Only copy state out under this lock.  Callbacks on the CA threads block while it is held.
             with self.data_ready_lock:
                 # Check if the FCC has gathered all the data we need.  Get it if so.
                 if self.data_ready:
-                    self.get_fpga_times()
                     # Set this to False so the next loop doesn't grab it again until the callback has found that a new
                     # set of data is ready to download.
                     self.data_ready = False
+                    self._ready_event.clear()
                     get_data = True
+                    waveforms = dict(self.waveforms)
+                    window_start = self.window_start
+                    window_end = self.window_end
 
-            # Get the waveforms
+            # Check the waveforms taken from the monitor cache
             if get_data:
+                self.get_fpga_times()
                 wf_values = {}
                 fpga_start = self.fpga_start
                 fpga_end = self.fpga_end
 
-                start = datetime.now()
-                for wf in self.waveform_pvs.values():
-                    wf_values[wf.pvname] = self.__get_pv(wf, use_monitor=False)
-                    # Warn if total download time was too long.
-                    duration = (datetime.now() - start).total_seconds()
-                    if duration > 1.5:
-                        print(f"{self.epics_name}: Warning.  Waveform downloads took {duration} seconds")
+                for pvname in self.waveform_pvs:
+                    if pvname not in waveforms:
+                        raise RuntimeError(f"{self.epics_name}: No data received for {pvname}")
+                    wf_values[pvname] = waveforms[pvname][0]
 
-                # Make sure that they look like a synchronous grouping.  These should throw if not.
-                for wf in self.waveform_pvs.values():
-                    self.__pv_in_window(wf)
+                # Make sure that they look like a synchronous grouping.  This should throw if not.
+                pvnames = list(wf_values)
+                timestamps = np.fromiter((waveforms[pvname][1] for pvname in pvnames), dtype=np.float64,
+                                         count=len(pvnames))
+                self.__pvs_in_window(pvnames, timestamps, window_start, window_end)
 
                 # Exit the loop so we can return the good data.
                 break
 
-            # Sleep for a little bit before we check again if data is ready.  pend_event more precides than time.sleep
-            epics.ca.pend_event(sleep_dur)
-            count += 1
-            if count * sleep_dur > timeout:
+            # Wait until the callback signals that data is ready.  Wake up every sleep_dur anyway to recheck the
+            # connection and the timeout.
+            self._ready_event.wait(timeout=sleep_dur)
+            if time.monotonic() > deadline:
                 raise RuntimeError(f"{self.epics_name}: Timed out waiting for good data. (> {timeout}s)")
 
         return wf_values, fpga_start, fpga_end
 
-    def __pv_in_window(self, pv):
-        """Check that the provided timestamp is within the acquisition window.  Raise exception if not.
+    def __pvs_in_window(self, pvnames: List[str], timestamps: np.ndarray, window_start, window_end):
+        """Check that the provided PV timestamps are within the acquisition window.  Raise exception if not.
+
+        The window bounds should be a consistent pair copied out under data_ready_lock.  Also raises if we have an
+        invalid window.
 
-        Should be called within a 'data_ready_lock'ed context.  Also raises if we have an invalid window
+        Args:
+            pvnames: The names of the PVs, in the same order as timestamps
+            timestamps: The timestamps of the PVs' latest updates
+            window_start: The earliest acceptable timestamp
+            window_end: The latest acceptable timestamp
         """
-        if self.window_end < self.window_start:
+        if window_end < window_start:
             raise RuntimeError(f"{self.epics_name}: Invalid data acquisition window")
-        if not self.window_start <= pv.timestamp <= self.window_end:
-            raise RuntimeError(f"{self.epics_name}: {pv.pvname} timestamp ({pv.timestamp}) outside acquisition window "
-                               f"({self.window_start}, {self.window_end}).")
+        outside = (timestamps < window_start) | (timestamps > window_end)
+        if outside.any():
+            idx = int(np.argmax(outside))
+            raise RuntimeError(f"{self.epics_name}: {pvnames[idx]} timestamp ({timestamps[idx]}) outside acquisition "
+                               f"window ({window_start}, {window_end}).")
 
     @staticmethod
     def __get_pv(pv, **kwargs):
@@ -282,157 +323,118 @@ class Cavity:
         return value
 
     @staticmethod
-    def __wait_for_pv(pv: epics.PV, value: Any, timeout: float = 5.0, delta: float = 0.005):
+    def __wait_for_pv(pv: epics.PV, value: Any, timeout: float = 5.0):
         """Pause execution until PV has been updated to specified value.
-        
+
         Args:
-            pv: The pv to wait for
+            pv: The pv to wait for.  Should be monitored since the wait is driven by its value callbacks.
             value: The value we want the PV to take before continuing
             timeout: Seconds to wait before raising an exception
-            delta: How long to sleep between checks of PV value
         """
-
-        # Since I'm waiting for a PV to reach a certain value, and not necessarily from a put/get call, I use the
-        # time.sleep method.
-        start = datetime.now()
+        # Since I'm waiting for a PV to reach a certain value, and not necessarily from a put/get call, I arm a one-shot
+        # value callback and sleep until it sees the value.
         if isinstance(value, float):
-            while not math.isclose(pv.get(), value):
-                time.sleep(delta)
-                if (datetime.now() - start).total_seconds() >= timeout:
-                    raise RuntimeError(f"Timed out waiting for {pv.pvname} == {value}")
+            # Roughly math.isclose's default relative tolerance, but computed once rather than on every update
+            tol = max(abs(value) * 1e-9, 1e-12)
+
+            def matches(curr):
+                return curr is not None and abs(curr - value) <= tol
         else:
-            while pv.get() != value:
-                time.sleep(delta)
-                if (datetime.now() - start).total_seconds() >= timeout:
-                    raise RuntimeError(f"Timed out waiting for {pv.pvname} == {value}")
+            def matches(curr):
+                return curr == value
+
+        reached = threading.Event()
+
+        def value_cb(value=None, **kwargs):
+            if matches(value):
+                reached.set()
+
+        index = pv.add_callback(value_cb)
+        try:
+            # Check after arming the callback so an update between the two can't be missed.
+            if not matches(pv.get()) and not reached.wait(timeout):
+                raise RuntimeError(f"Timed out waiting for {pv.pvname} == {value}")
+        finally:
+            pv.remove_callback(index)
+
+    @staticmethod
+    def __put_many(settings: List[Tuple[epics.PV, Any]], timeout: float = 5.0):
+        """Put several PVs at once and wait until the IOC has processed all of them.
+
+        Args:
+            settings: The (pv, value) pairs to put
+            timeout: Seconds to wait for all puts to complete before raising an exception
+        """
+        # Issue all puts before waiting on any so their round trips overlap.
+        pending = []
+        for pv, value in settings:
+            done = threading.Event()
+            pv.put(value, callback=lambda done=done, **kwargs: done.set())
+            pending.append((pv, value, done))
+        epics.ca.flush_io()
+
+        deadline = time.monotonic() + timeout
+        for pv, value, done in pending:
+            if not done.wait(max(0.0, deadline - time.monotonic())):
+                raise RuntimeError(f"Timed out waiting for put of {pv.pvname} = {value} to complete")
+
+    def __get_scope_settings(self) -> Tuple[Any, Any, Any, Any, Any]:
+        """Read the current (mode, sample_interval, trigger_delay, periodic, wf_debug) scope settings."""
+        return (self.__get_pv(self.scope_setting), self.__get_pv(self.sample_interval),
+                self.__get_pv(self.trigger_delay), self.__get_pv(self.periodic_setting), self.__get_pv(self.wf_debug))
+
+    def __apply_scope_settings(self, settings: Tuple[Any, Any, Any, Any, Any]):
+        """Reset the scope, apply the given settings, and then put the scope in the given mode.
+
+        Args:
+            settings: The (mode, sample_interval, trigger_delay, periodic, wf_debug) scope settings to apply
+        """
+        mode, sample_interval, trigger_delay, periodic, wf_debug = settings
+
+        # We need to turn the scope mode off.  Setting changes should only happen when scope is in off mode.
+        self.scope_setting.put(-1, wait=True)
+        # Particularly in development environment, this can take a long time to recover back to 0 after being reset.
+        self.__wait_for_pv(self.scope_setting, 0, timeout=10)
+
+        # Set the new scope parameters.  Returns once the IOC has processed every put.
+        self.__put_many([(self.sample_interval, sample_interval), (self.trigger_delay, trigger_delay),
+                         (self.periodic_setting, periodic), (self.wf_debug, wf_debug)])
+
+        # Put the scope operation back into the mode we want.  put returns -1 rather than raising if it times out.
+        if self.scope_setting.put(mode, wait=True, timeout=5) == -1:
+            raise RuntimeError(f"Timed out waiting for put of {self.scope_setting.pvname} = {mode} to complete")
+        self.__wait_for_pv(self.scope_setting, mode, timeout=5)
 
     def setup_scope(self, mode=3):
         """Put the scope into the desired configuration.
 
         Only change the scope if necessary as a full scope system is necessary.
         """
-        curr_mode = self.__get_pv(self.scope_setting)
-        curr_sample_interval = self.__get_pv(self.sample_interval)
-        curr_trigger_delay = self.__get_pv(self.trigger_delay)
-        curr_periodic_setting = self.__get_pv(self.periodic_setting)
-        curr_debug_setting = self.__get_pv(self.wf_debug)
-
-        # These desired settings for data collection
-        sample_interval = 0.2
-        trigger_delay = 102.4
-        periodic = 0.1
-        wf_debug = 1
+        desired = (mode, *self.daq_scope_settings)
 
         # Only go through the trouble of reseting the scope system if we need to change the settings. K. Hesse
         # said that occassionally we have trouble with changing settings if a reset is not done first
-        if (curr_mode != mode) or (curr_sample_interval != sample_interval) or (
-                curr_trigger_delay != trigger_delay) or (curr_periodic_setting != periodic) or (
-                curr_debug_setting != wf_debug):
-            # We need to turn the scope mode off.  Apply our settings.  Turn it to periodic.  Unroll those changes
-            # when done.
-            self.scope_setting.put(-1, wait=True)
-            # Particularly in development environment, this can take a long time to recover back to 0 after being reset.
-            self.__wait_for_pv(self.scope_setting, 0, timeout=10)
-
-            # Set the new scope parameters
-            self.sample_interval.put(sample_interval)
-            self.trigger_delay.put(trigger_delay)
-            self.periodic_setting.put(periodic)
-            self.wf_debug.put(wf_debug)
-
-            # Wait to make sure they've been implemented
-            self.__wait_for_pv(self.sample_interval, sample_interval)
-            self.__wait_for_pv(self.trigger_delay, trigger_delay)
-            self.__wait_for_pv(self.periodic_setting, periodic)
-            self.__wait_for_pv(self.wf_debug, wf_debug)
-
-            # Put the scope operation back into the mode we want
-            self.scope_setting.put(mode, wait=True)
-            self.__wait_for_pv(self.scope_setting, mode)
+        if self.__get_scope_settings() != desired:
+            self.__apply_scope_settings(desired)
 
     def return_scope(self):
         """Put the scope back into it's original configuration."""
-        # When that context exits, we put it back in the old mode.
-        # Setting changes should only happen when scope is in off mode.
-        self.scope_setting.put(-1, wait=True)
-        self.__wait_for_pv(self.scope_setting, 0, timeout=10)
-
-        self.sample_interval.put(self.init_sample_interval)
-        self.trigger_delay.put(self.init_trigger_delay)
-        self.periodic_setting.put(self.init_periodic_setting)
-        self.wf_debug.put(self.init_debug_setting)
-
-        self.__wait_for_pv(self.sample_interval, self.init_sample_interval)
-        self.__wait_for_pv(self.trigger_delay, self.init_trigger_delay)
-        self.__wait_for_pv(self.periodic_setting, self.init_periodic_setting)
-        self.__wait_for_pv(self.wf_debug, self.init_debug_setting)
-
-        self.scope_setting.put(self.init_mode, wait=True)
-        self.__wait_for_pv(self.scope_setting, self.init_mode)
+        self.__apply_scope_settings((self.init_mode, self.init_sample_interval, self.init_trigger_delay,
+                                     self.init_periodic_setting, self.init_debug_setting))
 
     @contextmanager
     def scope_mode(self, mode=3):
         """Allows convenient flip to scope mode via context manager.  Restores original values on exiting context."""
         # Cache the values so we can restore
-        old_mode = self.__get_pv(self.scope_setting)
-        old_sample_interval = self.__get_pv(self.sample_interval)
-        old_trigger_delay = self.__get_pv(self.trigger_delay)
-        old_periodic_setting = self.__get_pv(self.periodic_setting)
-        old_debug_setting = self.__get_pv(self.wf_debug)
-
-        # These desired settings for data collection
-        sample_interval = 0.2
-        trigger_delay = 102.4
-        periodic = 0.1
-        wf_debug = 1
-
-        # Put the cavity into scope mode when called with 'with'.  Make sure we disable the first mode before updating
-        # the second.
-        try:
+        old_settings = self.__get_scope_settings()
 
-            # Only go through the trouble of reseting the scope system if we need to change the settings. K. Hesse
-            # said that occassionally we have trouble with changing settings if a reset is not done first
-            if (old_mode != mode) or (old_sample_interval != sample_interval) or (
-                    old_trigger_delay != trigger_delay) or (old_periodic_setting != periodic) or (
-                    old_debug_setting != wf_debug):
-                # We need to turn the scope mode off.  Apply our settings.  Turn it to periodic.  Unroll those changes
-                # when done.
-                self.scope_setting.put(-1, wait=True)
-                # Particularly in development environment, this can take a long time to recover back to 0 after being
-                # reset.
-                self.__wait_for_pv(self.scope_setting, 0, timeout=10)
-
-                self.sample_interval.put(sample_interval)
-                self.trigger_delay.put(trigger_delay)
-                self.periodic_setting.put(periodic)
-                self.wf_debug.put(wf_debug)
-
-                self.__wait_for_pv(self.sample_interval, sample_interval)
-                self.__wait_for_pv(self.trigger_delay, trigger_delay)
-                self.__wait_for_pv(self.periodic_setting, periodic)
-                self.__wait_for_pv(self.wf_debug, wf_debug)
-
-                self.scope_setting.put(mode, wait=True)
-                self.__wait_for_pv(self.scope_setting, mode)
+        # Put the cavity into scope mode when called with 'with'.
+        try:
+            self.setup_scope(mode)
 
             # yield so we can run statements from body of 'with' statement with cavity in scope mode.
             yield
 
         finally:
             # When that context exits, we put it back in the old mode.
-            # Setting changes should only happen when scope is in off mode.
-            self.scope_setting.put(-1, wait=True)
-            self.__wait_for_pv(self.scope_setting, 0, timeout=10)
-
-            self.sample_interval.put(old_sample_interval)
-            self.trigger_delay.put(old_trigger_delay)
-            self.periodic_setting.put(old_periodic_setting)
-            self.wf_debug.put(old_debug_setting)
-
-            self.__wait_for_pv(self.sample_interval, old_sample_interval)
-            self.__wait_for_pv(self.trigger_delay, old_trigger_delay)
-            self.__wait_for_pv(self.periodic_setting, old_periodic_setting)
-            self.__wait_for_pv(self.wf_debug, old_debug_setting)
-
-            self.scope_setting.put(old_mode, wait=True)
-            self.__wait_for_pv(self.scope_setting, old_mode)
+            self.__apply_scope_settings(old_settings)
@@ -1,29 +1,41 @@
 """A class for managing data collection tasks"""
+import logging
+import queue
+import random
 import threading
 import time
-from datetime import datetime, timedelta
+from datetime import datetime
 from pathlib import Path
-from typing import List, Dict, Tuple, Optional
-import warnings
+from typing import Dict, Tuple, Optional, Sequence
 
 import epics.ca
 import numpy as np
-import pandas as pd
 from mysql.connector import PoolError
 from mysql.connector.pooling import MySQLConnectionPool, PooledMySQLConnection
 from rfscopedb.data_model import Scan
 
 from .cavity import Cavity
 
+logger = logging.getLogger(__name__)
+
+# CA field types (with any 'time_'/'ctrl_' prefix removed) whose scalar values belong with the float metadata
+_NUMERIC_FIELD_TYPES = frozenset(('short', 'int', 'long', 'char', 'enum', 'float', 'double'))
+
 
 # pylint: disable=too-many-instance-attributes
 class DaqThread(threading.Thread):
     """A class that manages collecting and storing data for a single cavity."""
 
+    # How many scans to buffer before inserting them all over a single database connection
+    db_batch_size = 16
+
+    # How many acquired samples may wait to be stored before acquisition blocks
+    write_queue_size = 4
+
     # pylint: disable=too-many-arguments
-    def __init__(self, *, exit_event: threading.Event, epics_name: str, out_dir: Path, signals: List[str],
+    def __init__(self, *, exit_event: threading.Event, epics_name: str, out_dir: Path, signals: Sequence[str],
                  duration: float, db_pool: Optional[MySQLConnectionPool], output: str,
-                 meta_pvs: List[str] = None):
+                 meta_pvs: Sequence[str] = None):
         """Create a thread that will collect and store data for a single cavity.
 
         This job will cycle for duration minutes.  
@@ -49,9 +61,7 @@ class DaqThread(threading.Thread):
         self.errors = []
 
         # Construct all of the metadata PVs
-        self.meta_pvs = []
-        for pv in meta_pvs:
-            self.meta_pvs.append(epics.PV(pv))
+        self.meta_pvs = [epics.PV(pv) for pv in meta_pvs]
 
         self.cavity = Cavity(epics_name=self.epics_name, waveform_signals=self.signals)
 
@@ -59,6 +69,30 @@ class DaqThread(threading.Thread):
         for pv in self.meta_pvs:
             pv.wait_for_connection()
 
+        # PV field types and element counts don't change, so decide once which metadata PVs are numeric.  Only scalars
+        # are numeric.  Arrays, including char arrays holding long strings, are stored as strings.  None if the PV never
+        # connected and its type is unknown.
+        self.meta_numeric = []
+        for pv in self.meta_pvs:
+            field_type = pv.type.rsplit('_', 1)[-1]
+            self.meta_numeric.append(None if field_type == 'unknown'
+                                     else pv.count == 1 and field_type in _NUMERIC_FIELD_TYPES)
+
+        # The scope's sample interval during collection.  Read once at the start of run since it doesn't change.
+        self.sample_interval_s = None
+
+        # Reusable array for stacking data in write_files and the sample interval its time column was built with
+        self.data_buffer = None
+        self.data_buffer_dt = None
+
+        # Acquired samples are handed to a writer thread so storing one overlaps with acquiring the next.  None tells
+        # the writer to stop.
+        self.write_queue = queue.Queue(maxsize=self.write_queue_size)
+        self.writer = threading.Thread(target=self.write_loop, name=f"{epics_name}-writer")
+
+        # Scans waiting to be inserted into the database
+        self.scan_buffer = []
+
         # Track samples that worked/failed
         self.n_success = 0
         self.n_attempts = 0
@@ -71,40 +105,38 @@ class DaqThread(threading.Thread):
             # Use the context initialized in the main thread
             epics.ca.use_initial_context()
 
-            # We want all warnings to be raised as exceptions
-            np.seterr(all='raise')
-            with warnings.catch_warnings():
-                warnings.simplefilter("error")
-
+            # We want all numpy floating point errors to be raised as exceptions.  numpy's error state is per thread, so
+            # it has to be set here.  process_cavities turns warnings into exceptions.
+            with np.errstate(all='raise'):
                 try:
+                    self.writer.start()
+
                     # Put the cavity into the desired scope mode.  Make sure to return it to old mode when done.
                     self.cavity.setup_scope()
 
-                    current_time = datetime.now()
-                    stop_time = current_time + timedelta(seconds=self.duration * 60)
+                    # Track the run's length on the monotonic clock so wall clock adjustments can't stretch or cut it.
+                    stop_time = time.monotonic() + self.duration * 60
 
                     # grab sample rate (time_ms)
                     time_ms_stamp = self.cavity.sample_interval.get()
 
                     if time_ms_stamp is None:
                         raise RuntimeError(f"Error setting time_ms_stamp for: '{self.epics_name}")
-                    while current_time < stop_time:
+                    self.sample_interval_s = time_ms_stamp
+                    while time.monotonic() < stop_time:
                         if self.exit_event.is_set():
-                            print(f"{self.epics_name}: Exiting early")
+                            logger.info("%s: Exiting early", self.epics_name)
                             break
+                        if not self.writer.is_alive():
+                            # Nothing would store the samples we collect
+                            raise RuntimeError(f"{self.epics_name}: Writer thread stopped unexpectedly")
 
                         try:
                             # Recheck the scope is in the desired mode before every download.  Useful for long runs.
                             self.cavity.setup_scope()
 
                             # Wait until CEBAF and cavity is in a stable state or it is time to stop collecting.
-                            skip_loop = False
-                            while not self.cavity.is_state_valid():
-                                time.sleep(0.05)
-                                if (datetime.now() > stop_time) or self.exit_event.is_set():
-                                    skip_loop = True
-                                    break
-                            if skip_loop:
+                            if not self.wait_for_valid_state(stop_time):
                                 continue
 
                             # Here goes the actual data collection
@@ -115,15 +147,10 @@ class DaqThread(threading.Thread):
                             results_dict, start, end = self.cavity.get_waveforms()
 
                             float_meta, string_meta = self.get_meta_data()
-                            if self.output == "db":
-                                self.write_to_db(start_time=start, end_time=end,
-                                                 data_dict=results_dict, float_meta=float_meta, string_meta=string_meta,
-                                                 sampling_rate=1.0 / time_ms_stamp)
-                            elif self.output == "file":
-                                self.write_files(results=results_dict, start_time=start, end_time=end,
-                                                 f_metadata=float_meta, s_metadata=string_meta)
-
-                            self.n_success += 1
+
+                            # Hand off to the writer.  Waits if it has fallen too far behind.
+                            if not self.put_for_writer((start, end, results_dict, float_meta, string_meta)):
+                                logger.info("%s: Dropped a sample while exiting", self.epics_name)
                         # Broad exception since any problem needs to be swallowed and collection retried within the
                         # thread.
                         # pylint: disable=broad-exception-caught
@@ -132,10 +159,8 @@ class DaqThread(threading.Thread):
                         finally:
                             # Sleep a little bit so we don't eat up CPU needlessly.
                             time.sleep(0.025)
-                            current_time = datetime.now()
                 finally:
-                    # Put the scope back in its original settings.
-                    self.cavity.return_scope()
+                    self.finish_run()
 
         # Failure report should be emailed if we experienced many errors or no attempts were made (this case is the
         # likely one here).
@@ -143,11 +168,90 @@ class DaqThread(threading.Thread):
         except Exception as exc:
             self.errors.append(exc)
 
-    def get_connection_with_retry(self, max_retries=10, wait_time=0.1) -> PooledMySQLConnection:
+    def wait_for_valid_state(self, stop_time: float) -> bool:
+        """Wait until the cavity is in a valid state for collecting data, or until it is time to stop.
+
+        The cavity's monitors set state_valid_event, but the event is only a hint.  Every wakeup rechecks the PVs with
+        refresh_state_valid, which also clears an event that was left set by mistake so the next wait blocks again
+        rather than spinning.
+
+        Args:
+            stop_time: The time.monotonic() value at which collection should stop
+
+        Returns:
+            True if the cavity is in a valid state.  False if it is time to stop or exit_event is set.
+        """
+        while True:
+            self.cavity.state_valid_event.wait(timeout=0.5)
+            if self.cavity.refresh_state_valid():
+                return True
+            if (time.monotonic() > stop_time) or self.exit_event.is_set():
+                return False
+
+    def write_loop(self):
+        """Store the samples queued by run until it queues None.  Runs in the writer thread."""
+        # We want all warnings to be raised as exceptions.  numpy's error state is per thread.
+        with np.errstate(all='raise'):
+            while True:
+                sample = self.write_queue.get()
+                if sample is None:
+                    break
+
+                start, end, results_dict, float_meta, string_meta = sample
+                try:
+                    if self.output == "db":
+                        self.write_to_db(start_time=start, end_time=end,
+                                         data_dict=results_dict, float_meta=float_meta, string_meta=string_meta,
+                                         sampling_rate=1.0 / self.sample_interval_s)
+                    elif self.output == "file":
+                        self.write_files(results=results_dict, start_time=start, end_time=end,
+                                         f_metadata=float_meta, s_metadata=string_meta)
+                        # Database scans are only counted once flush_to_db has inserted them
+                        self.n_success += 1
+                # Broad exception since any problem needs to be swallowed so the writer keeps storing later samples.
+                # pylint: disable=broad-exception-caught
+                except Exception as exc:
+                    self.errors.append(exc)
+
+    def put_for_writer(self, item, stop_on_exit: bool = True) -> bool:
+        """Queue an item for the writer thread, waiting while the queue is full.
+
+        Wakes up periodically so that a stuck or dead writer can't block this thread forever.
+
+        Args:
+            item: The sample to store, or None to stop the writer
+            stop_on_exit: Give up if exit_event is set while waiting
+
+        Returns:
+            True if the item was queued.  False if the writer is not running or we gave up because of exit_event.
+        """
+        while self.writer.is_alive():
+            try:
+                self.write_queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                if stop_on_exit and self.exit_event.is_set():
+                    return False
+        return False
+
+    def finish_run(self):
+        """Put the scope back in its original settings and write out any samples still waiting to be stored."""
+        try:
+            self.cavity.return_scope()
+        finally:
+            if self.writer.ident is not None:
+                # Let the writer drain the queue before stopping it.  Samples already collected are still stored even
+                # if we are exiting early.
+                self.put_for_writer(None, stop_on_exit=False)
+                self.writer.join()
+            self.flush_to_db()
+
+    def get_connection_with_retry(self, max_retries=10, wait_time=0.1, max_wait=1.0) -> PooledMySQLConnection:
         """Attempts to get a connection from the pool, waiting if necessary.
 
         We may use a small pool so waiting might be necessary. This could be run across the entire linac and saturate
-        the database server.
+        the database server.  Waits back off exponentially from wait_time up to max_wait with random jitter so that
+        threads that collided once don't retry in lockstep.
         """
 
         conn = None
@@ -160,7 +264,7 @@ class DaqThread(threading.Thread):
                 break
             except PoolError:
                 if attempt < max_retries - 1:
-                    time.sleep(wait_time)
+                    time.sleep(min(wait_time * 2 ** attempt, max_wait) * random.uniform(0.5, 1.5))
                 else:
                     raise
         return conn
@@ -178,15 +282,13 @@ class DaqThread(threading.Thread):
         # automonitor and the PV was connected at the start.
         f_metadata = {}
         s_metadata = {}
-        for pv in self.meta_pvs:
-            val = pv.get()
-            if isinstance(val, float):
-                f_metadata[pv.pvname] = val
-            elif isinstance(val, int):
-                f_metadata[pv.pvname] = float(val)
-            elif val is None:
+        for pv, numeric in zip(self.meta_pvs, self.meta_numeric):
+            val = pv.value
+            if val is None:
                 # Most PVs we watch are floats.  Without more knowledge about the PV type, pick the most likely type.
                 f_metadata[pv.pvname] = None
+            elif numeric or (numeric is None and isinstance(val, (int, float))):
+                f_metadata[pv.pvname] = float(val)
             else:
                 s_metadata[pv.pvname] = str(val)
 
@@ -198,28 +300,62 @@ class DaqThread(threading.Thread):
         tsv_file, cavity_dir = self.get_cavity_filepath(start_time=start_time, end_time=end_time)
         cavity_dir.mkdir(parents=True, exist_ok=True)
 
-        # Convert the data to a more friendly format and generate a timestamp column
-        df = pd.DataFrame(results).astype(float)
-        df.insert(0, 'Time', self.generate_time_column(wf_length=df.shape[0]))
-        df['Time'] = df['Time'].astype(str)
+        # Stack the data into a single float array with a generated timestamp column first
+        wf_length = len(next(iter(results.values()))) if results else 0
+        data = self.get_data_buffer(wf_length=wf_length, n_signals=len(results))
+        if results:
+            np.stack(list(results.values()), axis=1, out=data[:, 1:])
+
+        # Build the whole file in memory so it goes to disk in a single write.
+        lines = []
+        if f_metadata is not None:
+            lines.extend(f"# {key}\t{val}\n" for key, val in f_metadata.items())
+        if s_metadata is not None:
+            lines.extend(f"# {key}\t\"{val}\"\n" for key, val in s_metadata.items())
+        lines.append("\t".join(['Time', *results.keys()]) + "\n")
+        # Time is written at full precision and the signals in scientific notation.  Formatting rows of plain floats
+        # from tolist() skips the per cell numpy scalar boxing that np.savetxt does.
+        row_fmt = "\t".join(['%s'] + ['%.5e'] * len(results)) + "\n"
+        lines.extend([row_fmt % tuple(row) for row in data.tolist()])
 
         with open(tsv_file, 'w', encoding="utf-8") as f:
-            if f_metadata is not None:
-                for key, val in f_metadata.items():
-                    f.write(f"# {key}\t{val}\n")
-            if s_metadata is not None:
-                for key, val in s_metadata.items():
-                    f.write(f"# {key}\t\"{val}\"\n")
-        df.to_csv(str(tsv_file), mode='a', sep='\t', index=None, float_format="%.5e", lineterminator='\n')
+            f.write("".join(lines))
+
+    def get_data_buffer(self, wf_length: int, n_signals: int) -> np.ndarray:
+        """Get the array used to stack data for write_files, with its time column already filled in.
 
-    def generate_time_column(self, wf_length: int):
-        """Generate a list for the time column in data files.  [0, ..., (wf_length-1) * sample_interval]
+        The array is reused between calls and only reallocated when its shape changes.  Its contents are overwritten
+        on every call, so callers should not hold on to it.
+
+        Args:
+            wf_length: Length of the waveforms
+            n_signals: Number of signals, i.e., the number of columns besides the time column
+        """
+        shape = (wf_length, n_signals + 1)
+        dt = self.get_sample_interval()
+        if self.data_buffer is None or self.data_buffer.shape != shape:
+            self.data_buffer = np.empty(shape, dtype=np.float64)
+            self.data_buffer_dt = None
+        if self.data_buffer_dt != dt:
+            self.data_buffer[:, 0] = self.generate_time_column(wf_length=wf_length, dt=dt)
+            self.data_buffer_dt = dt
+        return self.data_buffer
+
+    def get_sample_interval(self) -> float:
+        """Get the sample interval cached by run.  Falls back to reading the PV if run has not cached it."""
+        if self.sample_interval_s is not None:
+            return self.sample_interval_s
+        return self.cavity.sample_interval.get()
+
+    @staticmethod
+    def generate_time_column(wf_length: int, dt: float):
+        """Generate a list for the time column in data files.  [0, ..., (wf_length-1) * dt]
 
         Args:
             wf_length: Length of the time column.
+            dt: The sample interval
         """
-        # pandas seems to specify an ndarray as acceptable, but not list
-        return np.array([self.cavity.sample_interval.get() * i for i in range(wf_length)])
+        return np.arange(wf_length, dtype=np.float64) * dt
 
     def get_cavity_filepath(self, start_time: datetime, end_time: datetime) -> Path:
         """Generate the full path to the cavity file.
@@ -251,10 +387,34 @@ class DaqThread(threading.Thread):
         scan = Scan(start=start_time, end=end_time)
         scan.add_scan_data(float_data=float_meta, str_data=string_meta)
         scan.add_cavity_data(cavity=self.epics_name, data=data_dict, sampling_rate=sampling_rate)
+        self.scan_buffer.append(scan)
+        if len(self.scan_buffer) >= self.db_batch_size:
+            self.flush_to_db()
+
+    def flush_to_db(self):
+        """Insert all buffered scans into the scope waveform database using a single pooled connection.
+
+        Each successful insert counts towards n_success and each failure is recorded in errors.  A failed scan does not
+        stop the rest from being inserted.  The buffer is emptied either way so that a bad scan is not retried forever.
+        """
+        if len(self.scan_buffer) == 0:
+            return
+
         conn = None
         try:
             conn = self.get_connection_with_retry()
-            scan.insert_data(conn=conn)
+            for scan in self.scan_buffer:
+                # Broad exception since any problem with one scan should not cost us the others.
+                # pylint: disable=broad-exception-caught
+                try:
+                    scan.insert_data(conn=conn)
+                    self.n_success += 1
+                except Exception as exc:
+                    self.errors.append(exc)
+        # pylint: disable=broad-exception-caught
+        except Exception as exc:
+            self.errors.append(RuntimeError(f"Could not store {len(self.scan_buffer)} scans: {exc}"))
         finally:
+            self.scan_buffer.clear()
             if conn is not None:
                 conn.close()
@@ -1,13 +1,13 @@
 """A module for managing email actions"""
 from email.message import EmailMessage
 import smtplib
+import threading
 from typing import List
 
 
 # Structured this way for easy feature additions regarding types of email, etc.
-# pylint: disable=too-few-public-methods
 class EmailSender:
-    """A class for sending emails."""
+    """A class for sending emails.  Keeps its SMTP connection open between messages until closed."""
     def __init__(self, subject: str, fromaddr: str, toaddrs: List[str], smtp_server: str = 'localhost'):
         """Construct an instance with information on who to email.
 
@@ -23,6 +23,50 @@ class EmailSender:
         if isinstance(toaddrs, str):
             self.toaddrs = [toaddrs]
         self.smtp_server = smtp_server
+        # The recipients never change, so format the To header once
+        self._to_header = ",".join(self.toaddrs)
+
+        # The SMTP connection is opened on first use and reused for later messages.  Access should be synchronized
+        # using _smtp_lock.
+        self._smtp = None
+        self._smtp_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _get_conn(self) -> smtplib.SMTP:
+        """Get a live SMTP connection, reconnecting if the server has dropped the old one.
+
+        Should be called within a '_smtp_lock'ed context.
+        """
+        if self._smtp is not None:
+            try:
+                self._smtp.noop()
+            except (smtplib.SMTPException, OSError):
+                self._drop_conn()
+        if self._smtp is None:
+            self._smtp = smtplib.SMTP(self.smtp_server)
+        return self._smtp
+
+    def _drop_conn(self):
+        """Close the SMTP connection without complaint if it is already gone.
+
+        Should be called within a '_smtp_lock'ed context.
+        """
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                self._smtp.close()
+            self._smtp = None
+
+    def close(self):
+        """Close the SMTP connection if one is open."""
+        with self._smtp_lock:
+            self._drop_conn()
 
     def send_txt_email(self, body: str):
         """Send a plain text email without attachments.
@@ -33,8 +77,13 @@ class EmailSender:
         msg = EmailMessage()
         msg['Subject'] = self.subject
         msg['From'] = self.fromaddr
-        msg['To'] = ",".join(self.toaddrs)
+        msg['To'] = self._to_header
         msg.set_content(body)
 
-        with smtplib.SMTP(self.smtp_server) as server:
-            server.send_message(msg)
+        with self._smtp_lock:
+            try:
+                self._get_conn().send_message(msg)
+            except smtplib.SMTPServerDisconnected:
+                # The server may drop an idle connection between the liveness check and the send.  Retry once.
+                self._drop_conn()
+                self._get_conn().send_message(msg)
@@ -1,5 +1,9 @@
 """A module for managing the entry point to the application"""
-import copy
+import gc
+import logging
+import os
+from logging.handlers import QueueHandler, QueueListener
+import queue
 import signal
 import threading
 from pathlib import Path
@@ -8,6 +12,7 @@ import argparse
 from datetime import datetime
 import re
 from typing import List, Tuple
+import warnings
 
 from mysql.connector.conversion import MySQLConverter
 from mysql.connector.pooling import MySQLConnectionPool
@@ -25,6 +30,24 @@ from .email_sender import EmailSender
 # Signal all threads to exit
 EXIT_EVENT = threading.Event()
 
+# Configuration file used when none is given on the command line
+_DEFAULT_CFG_PATH = str(Path(cfg.CSUE_CONFIG_DIR) / "cfg.yaml")
+
+# Formats of EPICS cavity and zone names, e.g., R1M1 and R1M
+_CAVITY_RE = re.compile(r"R\d\w\d\Z")
+_ZONE_RE = re.compile(r"R\d\w\Z")
+
+# Valid zones of each linac (0=Inj, 1=NL, 2=SL) and cavities of each zone
+_LINAC_ZONES = frozenset("23456789ABCDEFGHIJKLMNOPQ")
+_VALID_ZONES_BY_LINAC = {"0": frozenset("234"), "1": _LINAC_ZONES, "2": _LINAC_ZONES}
+_VALID_CAVITIES = frozenset("12345678")
+# Keyed by linac and zone.  Zones not listed have all of _VALID_CAVITIES.
+_VALID_CAVITIES_BY_ZONE = {"02": frozenset("78")}
+# Every valid zone and cavity name, so that valid names are accepted with a single lookup
+_ZONE_NAMES = frozenset(f"R{linac}{zone}" for linac, zones in _VALID_ZONES_BY_LINAC.items() for zone in zones)
+_CAVITY_NAMES = frozenset(f"{zone}{cav}" for zone in _ZONE_NAMES
+                          for cav in _VALID_CAVITIES_BY_ZONE.get(zone[1:], _VALID_CAVITIES))
+
 
 class NumpyConverterClass(MySQLConverter):
     """Class for converting numpy numeric types to those supported by mysql-connector-python."""
@@ -55,6 +78,25 @@ def handler(*args, **kwargs):
     EXIT_EVENT.set()
 
 
+def start_logging(quiet: bool) -> QueueListener:
+    """Route all log records through a queue so the DAQ threads never block on console output.
+
+    Args:
+        quiet: Only log warnings and errors
+
+    Returns:
+        The started listener.  Stop it before exiting so that any queued records are written.
+    """
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.addHandler(QueueHandler(log_queue))
+    root.setLevel(logging.WARNING if quiet else logging.INFO)
+
+    listener = QueueListener(log_queue, logging.StreamHandler())
+    listener.start()
+    return listener
+
+
 def process_cavities(cavities, out_dir, output: str):
     """Collect data from the specified cavities.
 
@@ -64,41 +106,57 @@ def process_cavities(cavities, out_dir, output: str):
         output: Where to store data
     """
 
-    # Initialize EPICS context that will be used by worker threads
-    epics.ca.create_context()
-
-    # Define handlers for common 'exit now' signals
+    # Define handlers for common 'exit now' signals.  Do this first so that a Ctrl-C during EPICS setup is not lost.
     signal.signal(signal.SIGINT, handler)
     signal.signal(signal.SIGTERM, handler)
 
+    # Initialize EPICS context that will be used by worker threads
+    epics.ca.create_context()
+
     # Use a pool with a small number of connections.  First because the pool handles thready safety where a single
     # connection does not.  Second, becuase if we used a larger pool size and launched this script once per zone, then
-    # we could exhaust the number of connections on the database (often ~150).
+    # we could exhaust the number of connections on the database (often ~150).  Never open more connections than there
+    # are threads to use them.
     pool = None
-    pool_size = 1 if len(cavities) == 1 else cfg.get_parameter(['db_config', 'pool_size'])
     if output == "db":
-        db_config = copy.deepcopy(cfg.get_parameter('db_config'))
-        del db_config['pool_size']
+        pool_size = max(1, min(len(cavities), cfg.get_parameter(['db_config', 'pool_size'])))
+        db_config = {key: value for key, value in cfg.get_parameter('db_config').items() if key != 'pool_size'}
         pool = MySQLConnectionPool(pool_name="scope-pool", pool_size=pool_size, pool_reset_session=True,
                                    converter_class=NumpyConverterClass, **db_config)
 
+    # These are the same for every cavity, so look them up once
+    duration, signals, meta_pvs = cfg.get_parameters(['duration', 'signals', 'meta_pvs'])
     threads = []
     for cavity in cavities:
-        threads.append(DaqThread(exit_event=EXIT_EVENT, epics_name=cavity, duration=cfg.get_parameter('duration'),
-                                 out_dir=out_dir, signals=cfg.get_parameter('signals'),
-                                 db_pool=pool, output=output, meta_pvs=cfg.get_parameter('meta_pvs')))
-
-    # Kick off the threads
-    for thread in threads:
-        thread.start()
-
-    # Wait for the threads to join.
-    for thread in threads:
-        # Python join is a blocking operation even for signals.  Solution is to set a timeout in a loop, and keep
-        # joining as long as the thread is still alive.  This gives the signals a chance to be handled once every
-        # second. Alternative would be to check is_alive() with a sleep.
-        while thread.is_alive():
-            thread.join(timeout=0.1)
+        threads.append(DaqThread(exit_event=EXIT_EVENT, epics_name=cavity, duration=duration,
+                                 out_dir=out_dir, signals=signals,
+                                 db_pool=pool, output=output, meta_pvs=meta_pvs))
+
+    # Everything built so far (PVs, cavities, the pool) lives for the whole run.  Move it out of the collector's view so
+    # periodic GC passes don't keep rescanning it while threads are collecting data.
+    gc.freeze()
+
+    # We want all warnings raised in the DAQ threads to be raised as exceptions.  The warnings filters are process
+    # wide, so set them once here rather than having every thread swap them in and out.
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+
+        # Kick off the threads
+        for thread in threads:
+            thread.start()
+
+        # Wait for the threads to join.
+        for thread in threads:
+            if os.name == 'nt':
+                # On Windows, join is a blocking operation even for signals.  Solution is to set a timeout in a loop,
+                # and keep joining as long as the thread is still alive.  This gives the signals a chance to be handled
+                # regularly.
+                while thread.is_alive():
+                    thread.join(timeout=0.1)
+            else:
+                # On POSIX, signal handlers still run while the main thread is blocked in join.  The handler sets
+                # EXIT_EVENT and the threads wind down, so there is no need to keep waking up.
+                thread.join()
 
     send_failure_report(threads=threads)
 
@@ -112,30 +170,25 @@ def send_failure_report(threads: List[DaqThread]):
         threads: The set of threads that have performed data collection.
     """
 
+    email, to_addrs, from_addr, failure_threshold = cfg.get_parameters(
+        ['email', ['email', 'to_addrs'], ['email', 'from_addr'], 'failure_threshold'])
+
     # Check if we can send an email
-    if (cfg.get_parameter('email') is None) or (len(cfg.get_parameter(['email', 'to_addrs'])) == 0):
+    if (email is None) or (len(to_addrs) == 0):
         return
 
-    max_fail_percent = 0.0
-    for thread in threads:
-        if thread.n_attempts == 0:
-            max_fail_percent = 1.0
-            break
-
-        # Calculate the current failure percentage and compare against current max.
-        max_fail_percent = max(max_fail_percent, 1.0 - float(thread.n_success) / thread.n_attempts)
-
-    if max_fail_percent >= cfg.get_parameter('failure_threshold'):
-        mailer = EmailSender(subject="RFWScopeDAQ Failure Report", toaddrs=cfg.get_parameter(['email', 'to_addrs']),
-                             fromaddr=cfg.get_parameter(['email', 'from_addr']))
-        msg = f"Failure report for run ending at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n"
+    # Stop at the first thread that crosses the threshold.  A thread that never attempted a collection failed entirely.
+    if any(thread.n_attempts == 0 or 1.0 - float(thread.n_success) / thread.n_attempts >= failure_threshold
+           for thread in threads):
+        parts = [f"Failure report for run ending at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n"]
         for thread in threads:
-            msg += f"{thread.epics_name}: {thread.n_success} / {thread.n_attempts} attempts succeeded\n"
-            for error in thread.errors:
-                msg += f"  {error}\n"
-            msg += "\n"
+            parts.append(f"{thread.epics_name}: {thread.n_success} / {thread.n_attempts} attempts succeeded\n")
+            parts.extend(f"  {error}\n" for error in thread.errors)
+            parts.append("\n")
+        msg = "".join(parts)
 
-        mailer.send_txt_email(msg)
+        with EmailSender(subject="RFWScopeDAQ Failure Report", toaddrs=to_addrs, fromaddr=from_addr) as mailer:
+            mailer.send_txt_email(msg)
 
 
 def validate_cavity(cavity: str):
@@ -145,24 +198,15 @@ def validate_cavity(cavity: str):
         cavity: Cavity name to validate
     """
 
-    valid_linacs = "012"
-    valid_zones = "23456789ABCDEFGHIJKLMNOPQ"
-    valid_cavities = "12345678"
+    if cavity in _CAVITY_NAMES:
+        return
 
-    if not re.match(r"R\d\w\d$", cavity):
+    # Not a valid name.  Work out why.
+    if not _CAVITY_RE.match(cavity):
         raise ValueError("Invalid cavity name.  Use EPICSName format ('R1M1').")
-    if cavity[1] not in valid_linacs:
-        raise ValueError("Invalid linac number.  Only use 0=Inj, 1=NL, or 2=SL.")
-
-    if cavity[0] == "1":
-        valid_zones = "234"
+    validate_zone(cavity[:3])
 
-    if cavity[2] not in valid_zones:
-        raise ValueError(f"Invalid zone.  Options for that linac are {valid_zones}.")
-
-    if cavity[1] == "0" and cavity[2] == '2':
-        valid_cavities = '78'
-    if cavity[3] not in valid_cavities:
+    if cavity[3] not in _VALID_CAVITIES_BY_ZONE.get(cavity[1:3], _VALID_CAVITIES):
         raise ValueError("Invalid cavity number.")
 
 
@@ -173,19 +217,18 @@ def validate_zone(zone: str):
         zone: Zone name to validate
     """
 
-    valid_linacs = "012"
-    valid_zones = "23456789ABCDEFGHIJKLMNOPQ"
+    if zone in _ZONE_NAMES:
+        return
 
-    if not re.match(r"R\d\w$", zone):
+    # Not a valid name.  Work out why.
+    if not _ZONE_RE.match(zone):
         raise ValueError("Invalid zone name.  Use EPICSName format ('R1M')")
-    if zone[1] not in valid_linacs:
-        raise ValueError("Invalid linac number.  Only use 0=Inj, 1=NL, or 2=SL")
-
-    if zone[1] == "0":
-        valid_zones = "234"
 
+    valid_zones = _VALID_ZONES_BY_LINAC.get(zone[1])
+    if valid_zones is None:
+        raise ValueError("Invalid linac number.  Only use 0=Inj, 1=NL, or 2=SL")
     if zone[2] not in valid_zones:
-        raise ValueError(f"Invalid zone.  Options for that linac are {valid_zones}")
+        raise ValueError(f"Invalid zone.  Options for that linac are {''.join(sorted(valid_zones))}")
 
 
 def check_and_alert_free_storage(check_dir):
@@ -194,18 +237,23 @@ def check_and_alert_free_storage(check_dir):
     Args:
         check_dir: Directory to check for free storage
     """
-    free_gb = shutil.disk_usage(check_dir).free / (1024 ** 3)
-    if free_gb < cfg.get_parameter("min_free_space"):
-        msg = f"Error: insufficient free space in {check_dir}.  {free_gb} GB < {cfg.get_parameter('min_free_space')}" \
-              " GB."
+    if os.name == 'nt':
+        free_gb = shutil.disk_usage(check_dir).free / (1 << 30)
+    else:
+        # Same syscall disk_usage makes, without its dispatch and namedtuple.  Cheap enough to poll during a run.
+        st = os.statvfs(check_dir)
+        free_gb = st.f_bavail * st.f_frsize / (1 << 30)
+    min_free_space, email, to_addrs, from_addr = cfg.get_parameters(
+        ["min_free_space", "email", ["email", "to_addrs"], ["email", "from_addr"]])
+    if free_gb < min_free_space:
+        msg = f"Error: insufficient free space in {check_dir}.  {free_gb} GB < {min_free_space} GB."
         # Only print a message if no email is configured
-        if (cfg.get_parameter("email") is None) or (len(cfg.get_parameter(['email', 'to_addrs'])) == 0):
+        if (email is None) or (len(to_addrs) == 0):
             print(msg)
         else:
-            sender = EmailSender(subject="RFWScopeDAQ: Insufficient free space",
-                                 fromaddr=cfg.get_parameter(["email", 'from_addr']),
-                                 toaddrs=cfg.get_parameter(["email", 'to_addrs']), )
-            sender.send_txt_email(msg)
+            with EmailSender(subject="RFWScopeDAQ: Insufficient free space", fromaddr=from_addr,
+                             toaddrs=to_addrs, ) as sender:
+                sender.send_txt_email(msg)
         return 1
     return 0
 
@@ -230,15 +278,13 @@ def process_args_and_cfg(args: argparse.Namespace) -> Tuple[List[str], Path]:
 
     base_dir = Path(cfg.get_parameter("base_dir"))
     app_start = datetime.now().strftime("%Y_%m_%d")
-    cavities = []
     if args.cavity is not None:
         out_dir = base_dir.joinpath(app_start, args.cavity[:-1])
-        cavities.append(args.cavity)
+        cavities = [args.cavity]
     elif args.zone is not None:
         validate_zone(args.zone)
         out_dir = base_dir.joinpath(app_start, args.zone)
-        for i in range(1, 9):
-            cavities.append(f"{args.zone}{i}")
+        cavities = [f"{args.zone}{i}" for i in range(1, 9)]
     else:
         raise ValueError("Cavity or Zone must be supplied to CLI.")
 
@@ -253,6 +299,7 @@ def process_args_and_cfg(args: argparse.Namespace) -> Tuple[List[str], Path]:
 
 def main():
     """This should be used as the entry point for the application."""
+    listener = None
     try:
         # Setup parser.  You can target either a cavity or a zone.  Secondary check is
         # required to make sure that the user hasn't blocked all output of results.
@@ -277,11 +324,12 @@ def main():
         parser.add_argument("-E", "--no-email", action='store_true',
                             help="Suppress generation of the email report")
         parser.add_argument("-f", "--file", type=str,
-                            default=f"{Path(cfg.CSUE_CONFIG_DIR).joinpath('cfg.yaml')}", help="Configuration file")
+                            default=_DEFAULT_CFG_PATH, help="Configuration file")
         parser.add_argument("-v", "--version", action='version', version='%(prog)s ' + __version__)
 
         # Process CLI arguments and config file
         args = parser.parse_args()
+        listener = start_logging(quiet=args.quiet)
         cavities, out_dir = process_args_and_cfg(args)
 
         # Check that we have sufficient free storage.  Exit if not.
@@ -302,5 +350,8 @@ def main():
     except Exception as e:
         print("Error:", e)
         return 1
+    finally:
+        if listener is not None:
+            listener.stop()
 
     return 0
@@ -0,0 +1,125 @@
+"""Unit tests for the application configuration module"""
+import os
+import tempfile
+from enum import Enum
+from unittest import TestCase
+
+from rfwscopedaq import app_config as cfg
+
+
+class TestAppConfig(TestCase):
+    """Class for testing app_config functions"""
+    def setUp(self):
+        """Write a small config file to parse"""
+        fd, self.filename = tempfile.mkstemp(suffix=".yaml")
+        with os.fdopen(fd, mode="w", encoding="utf-8") as f:
+            f.write("duration: 5.0\ndb_config:\n  user: 'scope_rw'\n  pool_size: 8\n")
+
+    def tearDown(self):
+        """Clean up the config file, its cache, and the parsed configuration"""
+        os.remove(self.filename)
+        if os.path.exists(f"{self.filename}.cache.json"):
+            os.remove(f"{self.filename}.cache.json")
+        cfg.clear_config()
+
+    def test_parse_config_file1(self):
+        """Test that parsed values are available"""
+        cfg.parse_config_file(self.filename)
+        self.assertEqual(5.0, cfg.get_parameter("duration"))
+        self.assertEqual("scope_rw", cfg.get_parameter(["db_config", "user"]))
+
+    def test_parse_config_file2(self):
+        """Test that set_parameter changes do not survive a reparse of an unchanged file"""
+        cfg.parse_config_file(self.filename)
+        cfg.set_parameter(["db_config", "user"], "other")
+        cfg.parse_config_file(self.filename)
+        self.assertEqual("scope_rw", cfg.get_parameter(["db_config", "user"]))
+
+    def test_parse_config_file3(self):
+        """Test that a modified file is reparsed"""
+        cfg.parse_config_file(self.filename)
+        with open(self.filename, mode="w", encoding="utf-8") as f:
+            f.write("duration: 10.0\n")
+        st = os.stat(self.filename)
+        os.utime(self.filename, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+        cfg.parse_config_file(self.filename)
+        self.assertEqual(10.0, cfg.get_parameter("duration"))
+
+    def test_set_parameter1(self):
+        """Test that set_parameter publishes a new config instead of modifying one handed out earlier"""
+        cfg.parse_config_file(self.filename)
+        old = cfg.get_parameter(None)
+        cfg.set_parameter(["db_config", "user"], "other")
+        self.assertEqual("scope_rw", old["db_config"]["user"])
+        self.assertEqual("other", cfg.get_parameter(["db_config", "user"]))
+        self.assertEqual(8, cfg.get_parameter(["db_config", "pool_size"]))
+
+    def test_get_config1(self):
+        """Test that get_config reflects the current config and validates it"""
+        cfg.parse_config_file(os.path.join(os.path.dirname(__file__), "..", "..", "..", "cfg.yaml"), use_cache=False)
+        self.assertEqual(1.0, cfg.get_config().min_beam_current)
+        cfg.set_parameter("min_beam_current", 2.0)
+        self.assertEqual(2.0, cfg.get_config().min_beam_current)
+        cfg.set_parameter("min_beam_current", "asdf")
+        with self.assertRaises(ValueError):
+            cfg.get_config()
+
+    def test_get_parameter1(self):
+        """Test that nested config values handed to readers can't be modified"""
+        cfg.parse_config_file(self.filename)
+        with self.assertRaises(TypeError):
+            cfg.get_parameter("db_config")["user"] = "other"
+
+    def test_get_parameter2(self):
+        """Test that str subclasses, like str enums, are treated as single keys"""
+        class Key(str, Enum):
+            """Names of config parameters"""
+            DURATION = "duration"
+            USER = "user"
+
+        cfg.parse_config_file(self.filename)
+        self.assertEqual(5.0, cfg.get_parameter(Key.DURATION))
+        self.assertEqual("scope_rw", cfg.get_parameter(["db_config", Key.USER]))
+
+    def test_get_parameters1(self):
+        """Test that several parameters can be fetched at once"""
+        cfg.parse_config_file(self.filename)
+        self.assertEqual([5.0, "scope_rw", None], cfg.get_parameters(["duration", ["db_config", "user"], "missing"]))
+
+    def test_validate_config1(self):
+        """Test that float parameters accept ints but not bools"""
+        cfg.parse_config_file(os.path.join(os.path.dirname(__file__), "..", "..", "..", "cfg.yaml"), use_cache=False)
+        cfg.set_parameter("failure_threshold", 0)
+        self.assertEqual(0.0, cfg.validate_config().failure_threshold)
+        cfg.set_parameter("failure_threshold", True)
+        with self.assertRaises(ValueError):
+            cfg.validate_config()
+
+    def test_parse_config_file4(self):
+        """Test that a new process reads the JSON cache instead of the YAML, until the YAML changes"""
+        cfg.parse_config_file(self.filename)
+        self.assertTrue(os.path.exists(f"{self.filename}.cache.json"))
+
+        # Forget the in-memory cache as a new process would, and make the YAML unparsable without changing its stat.
+        st = os.stat(self.filename)
+        cfg._PARSE_CACHE.clear()  # pylint: disable=protected-access
+        with open(self.filename, mode="r+", encoding="utf-8") as f:
+            f.write("[")
+        os.utime(self.filename, ns=(st.st_atime_ns, st.st_mtime_ns))
+        cfg.parse_config_file(self.filename)
+        self.assertEqual("scope_rw", cfg.get_parameter(["db_config", "user"]))
+
+        cfg._PARSE_CACHE.clear()  # pylint: disable=protected-access
+        with self.assertRaises(Exception):
+            cfg.parse_config_file(self.filename, use_cache=False)
+
+    def test_validate_config2(self):
+        """Test that type errors name the YAML types rather than the frozen ones"""
+        cfg.parse_config_file(os.path.join(os.path.dirname(__file__), "..", "..", "..", "cfg.yaml"), use_cache=False)
+        cfg.set_parameter("signals", "GMES")
+        with self.assertRaisesRegex(ValueError, "not required type 'list'.  Received 'GMES' of type 'string'"):
+            cfg.validate_config()
+        cfg.set_parameter("signals", ["GMES"])
+        cfg.set_parameter("db_config", ["localhost"])
+        with self.assertRaisesRegex(ValueError, "not required type 'mapping'.*of type 'list'"):
+            cfg.validate_config()
@@ -0,0 +1,133 @@
+"""Unit tests for the Cavity class"""
+from types import SimpleNamespace
+from unittest import TestCase
+from unittest.mock import patch
+
+import numpy as np
+
+from rfwscopedaq.cavity import Cavity
+
+
+class FakePV:
+    """Stand-in for epics.PV that is always connected and reads its value from a shared dictionary"""
+
+    # Current value of each PV by name.  Reset by each test.
+    values = {}
+
+    # pylint: disable=unused-argument
+    def __init__(self, pvname, **kwargs):
+        """Construct a FakePV, remembering how it was created"""
+        self.pvname = pvname
+        self.kwargs = kwargs
+        self.connected = True
+        self.callbacks = {}
+        self.put_result = 1
+        # Values the IOC replaces when they are put, e.g., a stop request that leaves the scope stopped
+        self.settle = {}
+
+    def wait_for_connection(self, timeout=None):
+        """Always connected"""
+        return True
+
+    def add_callback(self, callback):
+        """Register a callback and return its index"""
+        index = len(self.callbacks)
+        self.callbacks[index] = callback
+        return index
+
+    def remove_callback(self, index):
+        """Unregister a callback"""
+        self.callbacks.pop(index, None)
+
+    def get(self, **kwargs):
+        """Return the current value"""
+        return FakePV.values.get(self.pvname)
+
+    def put(self, value, callback=None, **kwargs):
+        """Update the value, notify callbacks, and report put_result"""
+        value = self.settle.get(value, value)
+        FakePV.values[self.pvname] = value
+        for cb in list(self.callbacks.values()):
+            cb(pvname=self.pvname, value=value)
+        if callback is not None:
+            callback(pvname=self.pvname)
+        return self.put_result
+
+
+def make_cavity():
+    """Construct a cavity R1M1 with GMES and PMES signals that is in a valid state for collecting data"""
+    FakePV.values = {"R1M1STAT1": 0, "R1M1RFONr": 1, "R1M1CNTL2MODE": 4, "R2XXITOT": 10.0, "R1M1WFSCOPrun": 3,
+                     "R1M1TRGS1": 0.2, "R1M1TRGD1": 102.4, "R1M1WFSCOPper": 0.1, "R1M1WFSdebug1": 1,
+                     "R1M1WFSharvTake": "2020-01-01 12:34:56.000001", "R1M1WFSharvDa": "2020-01-01 12:34:58.000002"}
+    with patch("rfwscopedaq.cavity.epics.PV", new=FakePV), \
+            patch("rfwscopedaq.cavity.cfg.get_config", return_value=SimpleNamespace(min_beam_current=1.0)):
+        cavity = Cavity(epics_name="R1M1", waveform_signals=("GMES", "PMES"))
+    cavity.scope_setting.settle = {-1: 0}
+    return cavity
+
+
+class TestCavity(TestCase):
+    """Class for testing Cavity methods"""
+    def test_get_waveforms1(self):
+        """Test that waveforms stamped by the IOC inside the acquisition window are accepted"""
+        cavity = make_cavity()
+        for pv in cavity.waveform_pvs.values():
+            self.assertEqual('time', pv.kwargs['form'])
+
+        # The sequencer and the waveform monitors both deliver IOC timestamps
+        cavity._data_ready_cb(value=128, timestamp=99.0)  # pylint: disable=protected-access
+        cavity._data_ready_cb(value=256, timestamp=100.0)  # pylint: disable=protected-access
+        cavity._waveform_cb(pvname="R1M1GMES", value=np.ones(4), timestamp=100.5)  # pylint: disable=protected-access
+        cavity._waveform_cb(pvname="R1M1PMES", value=np.zeros(4), timestamp=100.6)  # pylint: disable=protected-access
+        cavity._data_ready_cb(value=512, timestamp=101.0)  # pylint: disable=protected-access
+
+        waveforms, _, _ = cavity.get_waveforms(timeout=1)
+        np.testing.assert_array_equal(np.ones(4), waveforms["R1M1GMES"])
+        np.testing.assert_array_equal(np.zeros(4), waveforms["R1M1PMES"])
+
+    def test_get_waveforms2(self):
+        """Test that a waveform stamped outside the acquisition window is rejected"""
+        cavity = make_cavity()
+        cavity._data_ready_cb(value=128, timestamp=99.0)  # pylint: disable=protected-access
+        cavity._data_ready_cb(value=256, timestamp=100.0)  # pylint: disable=protected-access
+        cavity._waveform_cb(pvname="R1M1GMES", value=np.ones(4), timestamp=100.5)  # pylint: disable=protected-access
+        cavity._waveform_cb(pvname="R1M1PMES", value=np.zeros(4), timestamp=98.0)  # pylint: disable=protected-access
+        cavity._data_ready_cb(value=512, timestamp=101.0)  # pylint: disable=protected-access
+
+        with self.assertRaises(RuntimeError):
+            cavity.get_waveforms(timeout=1)
+
+    def test_setup_scope1(self):
+        """Test that the scope is put in the requested mode with the DAQ settings"""
+        cavity = make_cavity()
+        FakePV.values["R1M1WFSCOPrun"] = 0
+        with patch("rfwscopedaq.cavity.epics.ca.flush_io"):
+            cavity.setup_scope(mode=3)
+        self.assertEqual(3, FakePV.values["R1M1WFSCOPrun"])
+
+    def test_setup_scope2(self):
+        """Test that a scope mode put that times out raises"""
+        cavity = make_cavity()
+        FakePV.values["R1M1WFSCOPrun"] = 0
+        cavity.scope_setting.put_result = -1
+        with patch("rfwscopedaq.cavity.epics.ca.flush_io"), self.assertRaises(RuntimeError):
+            cavity.setup_scope(mode=3)
+
+    def test_refresh_state_valid1(self):
+        """Test that the state event follows the PVs and that errors in the check count as an invalid state"""
+        cavity = make_cavity()
+        with patch("rfwscopedaq.cavity.cfg.get_config", return_value=SimpleNamespace(min_beam_current=1.0)):
+            self.assertTrue(cavity.refresh_state_valid())
+            self.assertTrue(cavity.state_valid_event.is_set())
+
+            FakePV.values["R1M1RFONr"] = 0
+            cavity._state_cb()  # pylint: disable=protected-access
+            self.assertFalse(cavity.state_valid_event.is_set())
+
+            FakePV.values["R1M1RFONr"] = 1
+            self.assertTrue(cavity.refresh_state_valid())
+            self.assertTrue(cavity.state_valid_event.is_set())
+
+        with patch("rfwscopedaq.cavity.cfg.get_config", side_effect=ValueError("bad config")):
+            cavity._state_cb()  # pylint: disable=protected-access
+            self.assertFalse(cavity.state_valid_event.is_set())
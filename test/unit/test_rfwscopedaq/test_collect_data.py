@@ -5,6 +5,7 @@ from threading import Event
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
 import os
+import time
 from datetime import datetime
 import filecmp
 
@@ -70,3 +71,135 @@ class TestDAQThread(TestCase):
             # Make sure we clean up
             if tmp_path.exists():
                 shutil.rmtree(str(tmp_path))
+
+    def test_write_to_db(self):
+        """Test that scans are buffered and inserted in batches over a single connection"""
+        db_pool = MagicMock()
+        with patch("rfwscopedaq.collect_data.Cavity",
+                   new=lambda *args, **kwargs: MockCavity(0.2, *args, **kwargs)), \
+                patch("rfwscopedaq.collect_data.Scan") as scan:
+            thread = DaqThread(exit_event=Event(), epics_name="R123", out_dir=None, signals=["GMES"], duration=5.0,
+                               db_pool=db_pool, output="db", meta_pvs=[])
+            thread.db_batch_size = 2
+            kwargs = {"start_time": datetime.now(), "end_time": datetime.now(), "data_dict": {"GMES": np.ones(8)},
+                      "float_meta": {}, "string_meta": {}, "sampling_rate": 5.0}
+
+            thread.write_to_db(**kwargs)
+            db_pool.get_connection.assert_not_called()
+            thread.write_to_db(**kwargs)
+            db_pool.get_connection.assert_called_once()
+            self.assertEqual(2, scan.return_value.insert_data.call_count)
+
+            # The tail of the buffer is written when flushed
+            thread.write_to_db(**kwargs)
+            thread.flush_to_db()
+            self.assertEqual(2, db_pool.get_connection.call_count)
+            self.assertEqual(3, scan.return_value.insert_data.call_count)
+
+    def test_flush_to_db(self):
+        """Test that a failed insert is recorded without losing the scans after it"""
+        db_pool = MagicMock()
+        with patch("rfwscopedaq.collect_data.Cavity",
+                   new=lambda *args, **kwargs: MockCavity(0.2, *args, **kwargs)), \
+                patch("rfwscopedaq.collect_data.Scan") as scan:
+            scan.return_value.insert_data.side_effect = [None, RuntimeError("bad"), None]
+            thread = DaqThread(exit_event=Event(), epics_name="R123", out_dir=None, signals=["GMES"], duration=5.0,
+                               db_pool=db_pool, output="db", meta_pvs=[])
+            kwargs = {"start_time": datetime.now(), "end_time": datetime.now(), "data_dict": {"GMES": np.ones(8)},
+                      "float_meta": {}, "string_meta": {}, "sampling_rate": 5.0}
+            for _ in range(3):
+                thread.write_to_db(**kwargs)
+            thread.flush_to_db()
+
+        self.assertEqual(3, scan.return_value.insert_data.call_count)
+        self.assertEqual(2, thread.n_success)
+        self.assertEqual(1, len(thread.errors))
+        self.assertEqual(0, len(thread.scan_buffer))
+        db_pool.get_connection.return_value.close.assert_called_once()
+
+    def test_get_data_buffer(self):
+        """Test that the data buffer is reused until its shape changes"""
+        with patch("rfwscopedaq.collect_data.Cavity",
+                   new=lambda *args, **kwargs: MockCavity(0.2, *args, **kwargs)):
+            thread = DaqThread(exit_event=Event(), epics_name="R123", out_dir=None, signals=["GMES"], duration=5.0,
+                               db_pool=None, output="file", meta_pvs=[])
+            buf = thread.get_data_buffer(wf_length=4, n_signals=2)
+            self.assertEqual((4, 3), buf.shape)
+            np.testing.assert_array_equal(np.arange(4) * 0.2, buf[:, 0])
+            self.assertIs(buf, thread.get_data_buffer(wf_length=4, n_signals=2))
+            self.assertEqual((5, 3), thread.get_data_buffer(wf_length=5, n_signals=2).shape)
+
+    def test_get_meta_data(self):
+        """Test that metadata PVs are split into float and string values by their field type and element count"""
+        pvs = {"A": ("time_double", 1.5), "B": ("long", 2), "C": ("string", "asdf"), "D": ("double", None),
+               "E": ("unknown", 3), "F": ("char", 7), "G": ("time_char", np.array([97, 98], dtype=np.uint8)),
+               "H": ("double", np.array([1.0, 2.0]))}
+
+        def make_pv(name):
+            value = pvs[name][1]
+            pv = MagicMock(pvname=name, type=pvs[name][0], count=len(value) if isinstance(value, np.ndarray) else 1)
+            pv.value = value
+            return pv
+
+        with patch("rfwscopedaq.collect_data.Cavity",
+                   new=lambda *args, **kwargs: MockCavity(0.2, *args, **kwargs)), \
+                patch("rfwscopedaq.collect_data.epics.PV", new=make_pv):
+            thread = DaqThread(exit_event=Event(), epics_name="R123", out_dir=None, signals=["GMES"], duration=5.0,
+                               db_pool=None, output="file", meta_pvs=list(pvs.keys()))
+            f_metadata, s_metadata = thread.get_meta_data()
+
+        self.assertEqual({"A": 1.5, "B": 2.0, "D": None, "E": 3.0, "F": 7.0}, f_metadata)
+        self.assertIsInstance(f_metadata["B"], float)
+        self.assertEqual({"C": "asdf", "G": str(pvs["G"][1]), "H": str(pvs["H"][1])}, s_metadata)
+
+    def test_write_loop(self):
+        """Test that the writer stores queued samples until told to stop and records failures"""
+        with patch("rfwscopedaq.collect_data.Cavity",
+                   new=lambda *args, **kwargs: MockCavity(0.2, *args, **kwargs)):
+            thread = DaqThread(exit_event=Event(), epics_name="R123", out_dir=None, signals=["GMES"], duration=5.0,
+                               db_pool=None, output="file", meta_pvs=[])
+            with patch.object(thread, "write_files", side_effect=[None, RuntimeError("bad"), None]) as write_files:
+                for _ in range(3):
+                    thread.write_queue.put((datetime.now(), datetime.now(), {"GMES": np.ones(8)}, {}, {}))
+                thread.write_queue.put(None)
+                thread.write_loop()
+
+        self.assertEqual(3, write_files.call_count)
+        self.assertEqual(2, thread.n_success)
+        self.assertEqual(1, len(thread.errors))
+
+    def test_wait_for_valid_state(self):
+        """Test that a stale state event is rechecked and that waiting stops at exit"""
+        with patch("rfwscopedaq.collect_data.Cavity",
+                   new=lambda *args, **kwargs: MockCavity(0.2, *args, **kwargs)):
+            thread = DaqThread(exit_event=Event(), epics_name="R123", out_dir=None, signals=["GMES"], duration=5.0,
+                               db_pool=None, output="file", meta_pvs=[])
+        refresh = MagicMock(side_effect=[False, True])
+        thread.cavity.state_valid_event = Event()
+        thread.cavity.state_valid_event.set()
+        thread.cavity.refresh_state_valid = refresh
+        self.assertTrue(thread.wait_for_valid_state(stop_time=time.monotonic() + 5))
+        self.assertEqual(2, refresh.call_count)
+
+        refresh.side_effect = None
+        refresh.return_value = False
+        thread.exit_event.set()
+        self.assertFalse(thread.wait_for_valid_state(stop_time=time.monotonic() + 5))
+
+    def test_put_for_writer(self):
+        """Test that handing samples to a stuck or stopped writer gives up instead of blocking forever"""
+        with patch("rfwscopedaq.collect_data.Cavity",
+                   new=lambda *args, **kwargs: MockCavity(0.2, *args, **kwargs)):
+            thread = DaqThread(exit_event=Event(), epics_name="R123", out_dir=None, signals=["GMES"], duration=5.0,
+                               db_pool=None, output="file", meta_pvs=[])
+
+        # The writer was never started, so there is nothing to hand samples to
+        self.assertFalse(thread.put_for_writer(None))
+
+        # A writer that is alive but not taking samples.  Gives up once we are told to exit.
+        thread.writer = MagicMock()
+        thread.writer.is_alive.return_value = True
+        for _ in range(thread.write_queue_size):
+            self.assertTrue(thread.put_for_writer(None))
+        thread.exit_event.set()
+        self.assertFalse(thread.put_for_writer(None))
@@ -0,0 +1,29 @@
+"""Unit tests for the email sender"""
+import smtplib
+from unittest import TestCase
+from unittest.mock import patch
+
+from rfwscopedaq.email_sender import EmailSender
+
+
+class TestEmailSender(TestCase):
+    """Class for testing EmailSender methods"""
+    def test_send_txt_email1(self):
+        """Test that one SMTP connection is reused across messages and closed on exit"""
+        with patch("rfwscopedaq.email_sender.smtplib.SMTP") as smtp:
+            with EmailSender(subject="test", fromaddr="a@b.c", toaddrs="d@e.f") as sender:
+                sender.send_txt_email("one")
+                sender.send_txt_email("two")
+            smtp.assert_called_once_with("localhost")
+            self.assertEqual(2, smtp.return_value.send_message.call_count)
+            smtp.return_value.quit.assert_called_once()
+
+    def test_send_txt_email2(self):
+        """Test that a dropped connection is replaced"""
+        with patch("rfwscopedaq.email_sender.smtplib.SMTP") as smtp:
+            sender = EmailSender(subject="test", fromaddr="a@b.c", toaddrs=["d@e.f"])
+            sender.send_txt_email("one")
+            smtp.return_value.noop.side_effect = smtplib.SMTPServerDisconnected()
+            sender.send_txt_email("two")
+            self.assertEqual(2, smtp.call_count)
+            self.assertEqual(2, smtp.return_value.send_message.call_count)
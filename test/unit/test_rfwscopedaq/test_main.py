@@ -1,69 +1,65 @@
 """Unit tests for functions in the main module"""
+from itertools import product
+from types import SimpleNamespace
 from unittest import TestCase
-from rfwscopedaq.main import validate_zone, validate_cavity
+from unittest.mock import patch
+from rfwscopedaq.main import validate_zone, validate_cavity, send_failure_report, check_and_alert_free_storage
+
+# Every real zone and cavity name.  The injector (linac 0) only has zones 2-4, and zone 2 only has cavities 7 and 8.
+_ZONE_NAMES = tuple("R" + l + z for l, z in product("12", "23456789ABCDEFGHIJKLMNOPQ")) + ("R02", "R03", "R04")
+_CAVITY_NAMES = tuple(zone + c for zone, c in product(_ZONE_NAMES, "12345678") if zone != "R02") + ("R027", "R028")
+
+# Names that must be rejected: EPICS names of the wrong kind, CED names, junk, trailing newlines, and injector zones and
+# cavities that don't exist
+_BAD_CAVITY_NAMES = ("R1M", "1L22", "1L22-1", "asdf", "R1M1\n", "R0M1", "R021")
+_BAD_ZONE_NAMES = ("R1M1", "1L22", "1L22-1", "asdf", "R1M\n", "R0M")
 
 
 class TestMain(TestCase):
     """Class for testing functions in the main module"""
     def test_validate_cavity1(self):
         """Test that all real cavity names are accepted"""
-        for l in "12":
-            for z in "23456789ABCDEFGHIJKLMNOPQ":
-                for c in "12345678":
-                    validate_cavity(f"R{l}{z}{c}")
-        l = 0
-        for z in '34':
-            for c in "12345678":
-                validate_cavity(f"R{l}{z}{c}")
-
-        validate_cavity("R027")
-        validate_cavity("R028")
+        for cavity in _CAVITY_NAMES:
+            with self.subTest(cavity=cavity):
+                validate_cavity(cavity)
 
     def test_validate_cavity2(self):
-        """Test that an EPICS zone name is blocked"""
-        with self.assertRaises(ValueError):
-            validate_cavity("R1M")
-
-    def test_validate_cavity3(self):
-        """Test that a CED zone name is blocked"""
-        with self.assertRaises(ValueError):
-            validate_cavity("1L22")
-
-    def test_validate_cavity4(self):
-        """Test that a CED cavity name is blocked"""
-        with self.assertRaises(ValueError):
-            validate_cavity("1L22-1")
-
-    def test_validate_cavity5(self):
-        """Test that an all-around bad name is blocked"""
-        with self.assertRaises(ValueError):
-            validate_cavity("asdf")
+        """Test that invalid cavity names are blocked"""
+        for cavity in _BAD_CAVITY_NAMES:
+            with self.subTest(cavity=cavity), self.assertRaises(ValueError):
+                validate_cavity(cavity)
 
     def test_validate_zone1(self):
         """Test that all real zone names are accepted"""
-        for l in "12":
-            for z in "23456789ABCDEFGHIJKLMNOPQ":
-                validate_zone(f"R{l}{z}")
-        l = 0
-        for z in '234':
-            validate_zone(f"R{l}{z}")
+        for zone in _ZONE_NAMES:
+            with self.subTest(zone=zone):
+                validate_zone(zone)
 
     def test_validate_zone2(self):
-        """Test that an EPICS cavity name is blocked"""
-        with self.assertRaises(ValueError):
-            validate_zone("R1M1")
-
-    def test_validate_zone3(self):
-        """Test that a CED zone name is blocked"""
-        with self.assertRaises(ValueError):
-            validate_zone("1L22")
+        """Test that invalid zone names are blocked"""
+        for zone in _BAD_ZONE_NAMES:
+            with self.subTest(zone=zone), self.assertRaises(ValueError):
+                validate_zone(zone)
 
-    def test_validate_zone4(self):
-        """Test that a CED cavity name is blocked"""
-        with self.assertRaises(ValueError):
-            validate_zone("1L22-1")
+    def test_send_failure_report1(self):
+        """Test that a report is only sent when some thread reaches the failure threshold"""
+        params = [{}, ["a@b.c"], "d@e.f", 0.5]
+        ok = SimpleNamespace(epics_name="R1M1", n_success=9, n_attempts=10, errors=[])
+        bad = SimpleNamespace(epics_name="R1M2", n_success=5, n_attempts=10, errors=["timeout"])
+        idle = SimpleNamespace(epics_name="R1M3", n_success=0, n_attempts=0, errors=[])
+        with patch("rfwscopedaq.main.cfg.get_parameters", return_value=params), \
+                patch("rfwscopedaq.main.EmailSender") as sender:
+            send_failure_report([ok, ok])
+            sender.assert_not_called()
+            send_failure_report([ok, bad])
+            send_failure_report([idle, ok])
+            self.assertEqual(2, sender.call_count)
 
-    def test_validate_zone5(self):
-        """Test that an all around bad name is blocked"""
-        with self.assertRaises(ValueError):
-            validate_zone("asdf")
+    def test_check_and_alert_free_storage1(self):
+        """Test that free space is compared against the configured minimum"""
+        with patch("rfwscopedaq.main.cfg.get_parameters", return_value=[0, None, None, None]):
+            self.assertEqual(0, check_and_alert_free_storage("."))
+        with patch("rfwscopedaq.main.cfg.get_parameters", return_value=[float("inf"), None, None, None]), \
+                patch("builtins.print") as mock_print:
+            self.assertEqual(1, check_and_alert_free_storage("."))
+            mock_print.assert_called_once()